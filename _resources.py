@@ -3,9 +3,14 @@
 @author: Henry Keiter
 '''
 
+import array
+import gzip
+import mmap
 import os
 import string
-import gzip
+import struct
+import sys
+import tempfile
 
 NWS_DELIMITERS = ['--','-','\x97']
 PUNCTUATION = ''.join([string.punctuation, '\x92','\x93','\x94','\x97'])
@@ -164,8 +169,391 @@ def get_syllable_dict():
         print('Unable to open syllable file at {}'.format(syl_loc))
         return None
 
+# Compiled syllable dictionary layout (all integers little-endian):
+#   header:  magic, format version, entry count
+#   index:   65536+1 uint32 numbers of the first key whose first two bytes
+#            (the second taken as 0 for one-byte keys) are at least i
+#   offsets: count+1 uint32 absolute offsets of each key in the key blob
+#   counts:  count uint8 syllable counts
+#   keys:    utf-8 encoded keys, sorted bytewise, concatenated
+_SYL_MAGIC = b'PSYL'
+_SYL_VERSION = 2
+_SYL_HEADER = struct.Struct('<4sII4x')
+_SYL_BUCKETS = 1 << 16
+
+def _bucket(key):
+    '''Index bucket of a (non-empty) encoded key: its first two bytes.'''
+
+    return key[0] << 8 | (key[1] if len(key) > 1 else 0)
+
+def _uint32_view(buf, start, count):
+    '''Get `count` little-endian uint32s from `buf`, without copying them.'''
+
+    view = memoryview(buf)[start:start + 4*count]
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    view = array.array('I', view)
+    view.byteswap()
+    return view
+
+def _syllable_paths():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return (os.path.join(here, 'syll_dict.txt.gz'),
+            os.path.join(here, 'syll_dict.bin'))
+
+def _stem_table_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                        'syll_stems.bin')
+
+class SyllableLookup(object):
+    '''Read-only mapping from (lowercase) words/phrases to syllable-count.
+
+    This is backed by the compiled syllable dictionary (see 
+    `compile_syllable_dict`), held in any bytes-like buffer--normally an mmap
+    of the compiled file. Nothing is decoded or allocated up front: a lookup
+    goes straight to the keys sharing its first two bytes, and binary 
+    searches those. The mapped file is under 3MB, shared between processes;
+    a dict of the same words takes over 20MB in each one.
+
+    Multi-word entries ("a cappella") can be found by their first words with
+    `items(prefix)`.
+    '''
+
+    def __init__(self, buf):
+        if len(buf) < _SYL_HEADER.size:
+            raise ValueError('Truncated syllable dictionary')
+        magic, version, count = _SYL_HEADER.unpack_from(buf, 0)
+        if magic != _SYL_MAGIC or version != _SYL_VERSION:
+            raise ValueError('Unrecognized syllable dictionary format')
+        offsets_start = _SYL_HEADER.size + 4*(_SYL_BUCKETS + 1)
+        counts_start = offsets_start + 4*(count + 1)
+        keys_start = counts_start + count
+        if len(buf) < keys_start:
+            raise ValueError('Truncated syllable dictionary')
+        index = _uint32_view(buf, _SYL_HEADER.size, _SYL_BUCKETS + 1)
+        offsets = _uint32_view(buf, offsets_start, count + 1)
+        if offsets[count] != len(buf) or index[_SYL_BUCKETS] != count:
+            raise ValueError('Truncated syllable dictionary')
+        self._buf = buf
+        self._index = index
+        self._offsets = offsets
+        self._counts = memoryview(buf)[counts_start:keys_start]
+        self._len = count
+
+    def _lower_bound(self, key):
+        '''Number of the first key not less than the encoded `key`.'''
+
+        if not key:
+            return 0
+        buf, offsets = self._buf, self._offsets
+        bucket = _bucket(key)
+        lo, hi = self._index[bucket], self._index[bucket + 1]
+        while lo < hi:
+            mid = (lo + hi)//2
+            if buf[offsets[mid]:offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, key):
+        '''Search for the utf-8 encoded `key`; -1 if it is absent.'''
+
+        offsets = self._offsets
+        idx = self._lower_bound(key)
+        if idx < self._len and self._buf[offsets[idx]:offsets[idx + 1]] == key:
+            return idx
+        return -1
+
+    def get(self, word, default=None):
+        idx = self._find(word.encode('utf-8', 'surrogatepass'))
+        return default if idx < 0 else self._counts[idx]
+
+    def __getitem__(self, word):
+        count = self.get(word)
+        if count is None:
+            raise KeyError(word)
+        return count
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        buf, offsets = self._buf, self._offsets
+        for i in range(self._len):
+            yield bytes(buf[offsets[i]:offsets[i + 1]]).decode('utf-8')
+
+    def items(self, prefix=''):
+        '''Get the `(word, count)` pairs, in order, of words with `prefix`.
+
+        >>> list(lookup.items('a cap'))
+        [('a cappella', 4)]
+        '''
+
+        if not prefix:
+            return zip(self, self._counts)
+        return self._prefixed(prefix.encode('utf-8', 'surrogatepass'))
+
+    def _prefixed(self, prefix):
+        buf, offsets, counts = self._buf, self._offsets, self._counts
+        for i in range(self._lower_bound(prefix), self._len):
+            key = bytes(buf[offsets[i]:offsets[i + 1]])
+            if not key.startswith(prefix):
+                break
+            yield key.decode('utf-8'), counts[i]
+
+def _pack_syllable_dict(lookup):
+    '''Serialize a {word: count} dict into the compiled format.'''
+
+    keys = sorted(k.encode('utf-8') for k in lookup if k)
+    count = len(keys)
+    keys_start = (_SYL_HEADER.size + 4*(_SYL_BUCKETS + 1) + 4*(count + 1) + 
+                  count)
+    index = array.array('I', bytes(4*(_SYL_BUCKETS + 1)))
+    offsets = array.array('I', [keys_start])
+    for i, k in enumerate(keys):
+        index[_bucket(k) + 1] = i + 1
+        offsets.append(offsets[-1] + len(k))
+    for bucket in range(1, _SYL_BUCKETS + 1):
+        # Empty buckets start (and end) where the one before ended
+        index[bucket] = max(index[bucket], index[bucket - 1])
+    if sys.byteorder != 'little':
+        index.byteswap()
+        offsets.byteswap()
+    counts = bytes(lookup[k.decode('utf-8')] for k in keys)
+    return b''.join([_SYL_HEADER.pack(_SYL_MAGIC, _SYL_VERSION, count),
+                     index.tobytes(), offsets.tobytes(), counts] + keys)
+
+def _write_compiled(dest, data):
+    '''Write compiled `data` to `dest` atomically.'''
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dest)))
+    try:
+        with os.fdopen(fd, 'wb') as o:
+            o.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, dest)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return dest
+
+def _map_compiled(path, sources, compile_to):
+    '''Get a `SyllableLookup` over the compiled file at `path`.
+
+    The file is memory-mapped. It is (re)built by `compile_to(path)` first if
+    it is missing, older than any of the `sources`, or unreadable. Returns 
+    None if it can't be written.
+    '''
+
+    for attempt in range(2):
+        try:
+            if os.path.getmtime(path) >= max(map(os.path.getmtime, sources)):
+                with open(path, 'rb') as f:
+                    return SyllableLookup(mmap.mmap(f.fileno(), 0, 
+                                                    access=mmap.ACCESS_READ))
+        except (OSError, ValueError):
+            pass
+        if attempt == 0:
+            try:
+                compile_to(path)
+            except OSError:
+                break
+    return None
+
+def compile_syllable_dict(dest=None):
+    '''Compile the gzipped syllable dictionary into its binary form.
+
+    The result is written atomically to `dest` (by default `syll_dict.bin`, 
+    next to the source) and the path is returned.
+    '''
+
+    return _write_compiled(dest or _syllable_paths()[1], 
+                           _pack_syllable_dict(get_syllable_dict()))
+
+def load_syllable_lookup(path=None):
+    '''Get a `SyllableLookup` over the compiled syllable dictionary.
+
+    The compiled file is memory-mapped, so this is cheap. It is (re)built from
+    `syll_dict.txt.gz` if it is missing, stale or unreadable; if it can't be
+    written, the dictionary is compiled in memory instead.
+    '''
+
+    source, default_path = _syllable_paths()
+    compiled = _map_compiled(path or default_path, [source], 
+                             compile_syllable_dict)
+    if compiled is not None:
+        return compiled
+    lookup = get_syllable_dict()
+    if lookup is None:
+        return None
+    return SyllableLookup(_pack_syllable_dict(lookup))
+
+# Inflected forms fold into stems at least this long (so "bed" isn't "be"+d)
+MIN_STEM = 3
+POSSESSIVE_ENDINGS = ("'s", "\x92s")
+# Stems ending like these get an extra syllable from -s or -es
+_SIBILANT_ENDINGS = ('s', 'x', 'z', 'ch', 'sh', 'ce', 'se', 'ge', 'ze')
+
+def _undoubled(stem):
+    '''Get `stem` without a doubled final consonant ("stopp" -> "stop").'''
+
+    if len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in VOWELS:
+        return stem[:-1]
+    return None
+
+def _short_syllable(stem):
+    '''Whether `stem` is one syllable ending in a short vowel and consonant.
+
+    Such words double the consonant before -ing and -ed ("hop", "hopping"),
+    so an inflection that doesn't ("hoping") must be of the silent-e form 
+    ("hope").
+    '''
+
+    if len(stem) < 2 or stem[-1] in VOWELS or stem[-1] in 'wx':
+        return False
+    if stem[-2] not in VOWELS or len(stem) > 2 and stem[-3] in VOWELS:
+        return False
+    return sum(1 for i, c in enumerate(stem) 
+               if c in VOWELS and (i == 0 or stem[i - 1] not in VOWELS)) == 1
+
+def _suffix_stems(stem):
+    '''Get the stems that `stem`+ing or `stem`+ed may come from, best first.
+
+    A doubled consonant is undone ("putt" -> "put"), except for the -ll, -ss,
+    -ff and -zz that words end in anyway ("call"); a short syllable gets its
+    silent e back ("gaz" -> "gaze"), as does any other stem ending in a 
+    consonant after the plain one ("pac", then "pace").
+    '''
+
+    undoubled = _undoubled(stem)
+    if undoubled is not None:
+        if stem[-1] in 'lsfz':
+            return (stem, undoubled)
+        return (undoubled, stem)
+    if _short_syllable(stem):
+        return (stem + 'e',)
+    if stem[-1:] in VOWELS:
+        return (stem,)
+    return (stem, stem + 'e')
+
+def fold_candidates(word):
+    '''Get the stems that `word` may be an inflection of, best first.
+
+    Yields `(stem, syllables)` pairs, `syllables` being the number of
+    syllables the ending adds to the stem. The endings are 's, -ing, -ed and
+    -d, -es and -s; a word with none of them has no candidates. A stem from
+    -ed never ends in e ("indeed" isn't "inde"+ed), and one from -d or -s 
+    that does always ends in a silent e ("need" isn't "nee"+d, nor "does"
+    "doe"+s).
+    '''
+
+    if word.endswith(POSSESSIVE_ENDINGS):
+        yield word[:-2], int(word[:-2].endswith(_SIBILANT_ENDINGS))
+    elif word.endswith('ing'):
+        for stem in _suffix_stems(word[:-3]):
+            yield stem, 1
+    elif word.endswith(('ied', 'ies')):
+        yield word[:-3] + 'y', 0
+        yield word[:-1], 0
+    elif word.endswith('ed'):
+        syllables = int(word.endswith(('ted', 'ded')))
+        if not word.endswith('eed'):
+            for stem in _suffix_stems(word[:-2]):
+                yield stem, syllables
+    elif word.endswith('es'):
+        if word[-3:-2] not in VOWELS:
+            yield word[:-1], int(word[:-1].endswith(_SIBILANT_ENDINGS))
+        yield word[:-2], int(word[:-2].endswith(_SIBILANT_ENDINGS))
+    elif word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        yield word[:-1], 0
+
+def _stem_numbers(counts):
+    '''Find the stems of the inflected words in a {word: syllables} dict.
+
+    Returns {word: n}, where the word's stem is the `n`th (from 1) of its 
+    `fold_candidates`. See `StemTable` for the rules.
+    '''
+
+    numbers = {}
+    for word, count in counts.items():
+        if ' ' in word or word in COMMON_WORDS:
+            continue
+        for n, (stem, syllables) in enumerate(fold_candidates(word), 1):
+            if (len(stem) >= MIN_STEM and ' ' not in stem and
+                counts.get(stem, -1) + syllables == count):
+                numbers[word] = n
+                break
+    return numbers
+
+class StemTable(object):
+    '''Maps the inflected words of the syllable dictionary to their stems.
+
+    A word's stem is the first of its `fold_candidates` that is also in the
+    dictionary, is at least MIN_STEM letters long, and has as many syllables
+    as the ending calls for ("horses" is "horse", but "wicked" isn't "wick").
+    Common words are never inflections. `in` tells whether a word is in the
+    dictionary (`lookup`) at all, inflected or not.
+
+    The stems are worked out when the dictionary is compiled (see 
+    `compile_stem_table`), and kept in `numbers`--a `SyllableLookup`, or any
+    mapping, from each inflected word to the number of its stem among its
+    candidates.
+    '''
+
+    def __init__(self, numbers, lookup):
+        self._numbers = numbers
+        self._lookup = lookup
+
+    def get(self, word, default=None):
+        number = self._numbers.get(word)
+        if number is None:
+            return default
+        for n, (stem, _) in enumerate(fold_candidates(word), 1):
+            if n == number:
+                return stem
+        return default
+
+    def __contains__(self, word):
+        return word in self._lookup
+
+    def __len__(self):
+        return len(self._numbers)
+
+def compile_stem_table(dest=None):
+    '''Compile the stems of the syllable dictionary's words, for StemTable.
+
+    The result is written atomically to `dest` (by default `syll_stems.bin`,
+    next to the dictionary) and the path is returned.
+    '''
+
+    return _write_compiled(dest or _stem_table_path(), _pack_syllable_dict(
+                                    _stem_numbers(get_syllable_dict())))
+
+def load_stem_table(path=None):
+    '''Get a `StemTable` over the compiled stems and syllable dictionary.
+
+    The compiled stems are memory-mapped, like the dictionary. They are 
+    (re)built if they are missing, unreadable, or older than the dictionary's
+    source or the rules here; if they can't be written, they are worked out 
+    in memory instead.
+    '''
+
+    lookup = load_syllable_lookup()
+    if lookup is None:
+        return StemTable({}, {})
+    numbers = _map_compiled(path or _stem_table_path(), 
+                            [_syllable_paths()[0], os.path.abspath(__file__)],
+                            compile_stem_table)
+    if numbers is None:
+        numbers = _stem_numbers(dict(lookup.items()))
+    return StemTable(numbers, lookup)
+
 def main():
-    d = get_syllable_dict()
+    d = load_syllable_lookup()
     print(d.get('a cappella'))
 
 if __name__ == '__main__':
@@ -13,21 +13,58 @@ Created on Nov 26, 2012
 @version: Python 3.3
 '''
 
+__version__ = '0.2'
+# Raised whenever the results for the same text and options change (as when 
+# word forms were first folded into stems), so that older cached results
+# aren't used.
+RESULTS_FORMAT = 2
+# Identifies the results in prosl_cache
+CACHE_VERSION = '{}/{:d}'.format(__version__, RESULTS_FORMAT)
+
 import argparse
+import array
 import collections
+import concurrent.futures
+import contextlib
+import csv
+import fnmatch
+import glob
+import heapq
+import json
+import locale
+import mmap
 import os
+import re
 import sys
 import _resources
-from prosl_utils import split_string, memoized
+import prosl_cache
+from prosl_utils import (compile_splitter, memoized, HyperLogLog, 
+                         LazyResource, SpaceSaving)
+
+# Same as split_string(line, *_resources.NWS_DELIMITERS), but much faster
+_split_line = compile_splitter(*_resources.NWS_DELIMITERS)
 
-SYLLABLE_LOOKUP = _resources.get_syllable_dict()
+# Syllable counts are only needed for readability indices, so don't load 
+# them until then. (Both are memory-mapped files compiled once and kept, so 
+# loading is cheap anyway.)
+SYLLABLE_LOOKUP = LazyResource(_resources.load_syllable_lookup)
+# Only needed for word frequencies. It maps the dictionary too, to tell which
+# words are in it, and the compiled stems of those that are inflected.
+STEM_TABLE = LazyResource(_resources.load_stem_table)
 
 PROXIMITY_FLAG = 10
 CTHRESH_FLAG = 20
 WTHRESH_FLAG = 30
+FLAG_NAMES = {PROXIMITY_FLAG: 'proximity', CTHRESH_FLAG: 'char_count', 
+              WTHRESH_FLAG: 'word_count'}
+
+OUTPUT_FORMATS = ('text', 'jsonl', 'csv')
+CSV_COLUMNS = ('file', 'type', 'line', 'value', 'snippet')
+_OUTPUT_BUFFER = 1 << 16
+TOP_WORDS = 20
 
 
-@memoized
+@memoized(maxsize=1 << 17)
 def _count_syllables(word):
     '''Get a real or estimated value for the number of syllables in the word.
     
@@ -44,6 +81,28 @@ def _count_syllables(word):
         return _estimate_syllables(word)
     return count
 
+@memoized(maxsize=1 << 17)
+def _stem(word):
+    '''Get the stem that the (lowercase) word is counted under.
+
+    Inflected dictionary words have their stems in STEM_TABLE. Any other word
+    is an inflection of the first of its _resources.fold_candidates() that is
+    in the dictionary, if there is one; possessives always fold. Either way,
+    a word always gets the same stem, wherever and whenever it occurs.
+    '''
+
+    stem = STEM_TABLE.get(word)
+    if stem is not None:
+        return stem
+    if word in STEM_TABLE or word in _resources.COMMON_WORDS:
+        return word
+    if word.endswith(_resources.POSSESSIVE_ENDINGS):
+        return _stem(word[:-2])
+    for stem, _ in _resources.fold_candidates(word):
+        if len(stem) >= _resources.MIN_STEM and stem in STEM_TABLE:
+            return STEM_TABLE.get(stem, stem)
+    return word
+
 def _estimate_syllables(word):
     '''Estimate the number of syllables in the given word.
 
@@ -77,6 +136,79 @@ def _estimate_syllables(word):
         sylls -= 1
     return max(sylls, 1)
 
+# Fewest words _estimate_syllables_batch() hands to NumPy. Below this, 
+# importing it (if nothing else has) costs more than it saves.
+_BATCH_ESTIMATE_MIN = 256
+
+def _estimate_syllables_batch(words):
+    '''Estimate the syllables in each of `words`, as _estimate_syllables().
+
+    With NumPy, a few hundred words or more are estimated together in a few 
+    array passes, which is much faster for thousands of words. Otherwise, 
+    this just maps _estimate_syllables().
+    '''
+
+    words = list(words)
+    if len(words) < _BATCH_ESTIMATE_MIN:
+        return [_estimate_syllables(word) for word in words]
+    try:
+        import numpy
+    except ImportError:
+        return [_estimate_syllables(word) for word in words]
+    counts = [1 if word else 0 for word in words]
+    long_words = [i for i, word in enumerate(words) if len(word) >= 3]
+    if not long_words:
+        return counts
+    text = ''.join(words[i] for i in long_words)
+    chars = numpy.frombuffer(text.encode('utf-32-le', 'surrogatepass'),
+                             dtype=numpy.uint32)
+    lengths = numpy.fromiter((len(words[i]) for i in long_words),
+                             dtype=numpy.intp, count=len(long_words))
+    starts = numpy.zeros(len(long_words), dtype=numpy.intp)
+    numpy.cumsum(lengths[:-1], out=starts[1:])
+    vowels = numpy.fromiter(map(ord, _resources.VOWELS), dtype=numpy.uint32)
+    is_vowel = numpy.isin(chars, vowels)
+    # Vowel runs never cross from one word into the next
+    follows_vowel = numpy.zeros_like(is_vowel)
+    follows_vowel[1:] = is_vowel[:-1]
+    follows_vowel[starts] = False
+    run_start = is_vowel & ~follows_vowel
+    # Only every second vowel in a run is counted: 'uou' -> 2
+    positions = numpy.arange(len(chars))
+    run_offset = positions - numpy.maximum.accumulate(
+                                        numpy.where(run_start, positions, 0))
+    counted = is_vowel & (run_offset % 2 == 0)
+    sylls = numpy.add.reduceat(counted.astype(numpy.intp), starts)
+    last = chars[starts + lengths - 1]
+    sylls -= (last == ord('e')) | (last == ord('E'))
+    for i, count in zip(long_words, numpy.maximum(sylls, 1).tolist()):
+        counts[i] = count
+    return counts
+
+def _count_syllables_batch(words):
+    '''Get _count_syllables() for each of `words`, filling its cache.
+
+    Words that are neither cached nor in the dictionary are estimated in one
+    batch, by _estimate_syllables_batch().
+    '''
+
+    words = list(words)
+    cache = _count_syllables.cache
+    counts = {}
+    unknown = []
+    for word in set(words):
+        if (word,) in cache:
+            continue
+        count = SYLLABLE_LOOKUP.get(word)
+        if count is None:
+            unknown.append(word)
+        else:
+            counts[word] = count
+    counts.update(zip(unknown, _estimate_syllables_batch(unknown)))
+    _count_syllables.update(((word,), count) for word, count in counts.items())
+    return [counts[word] if word in counts else _count_syllables(word)
+            for word in words]
+
 def _gunning_fog_index(stats):
     '''
     Higher = more difficult
@@ -121,111 +253,934 @@ def _split_text(text):
     generator that yields `(line_num, token)` pairs. `line_num` is 1-indexed.
     '''
 
-    for line_num, line in enumerate(text.split('\n')):
-        for token in split_string(line, *_resources.NWS_DELIMITERS):
-            yield (line_num + 1, token)
+    return _split_lines(_iter_lines(text))
 
-def get_stats(text, indices=False):
-    '''Get a bunch of statistics about the text.'''
-    
-    split = [token for _, token in _split_text(text)]
-    stats = {
-             'Word Count':len(split),
-             'Character Count':len(text),
-             'Average Word Length':sum(map(len,split))/float(len(split)),
-             'Average Sentence Length':None
-             }
-    alnum_count = 0
-    if indices:
+def _iter_lines(text, block=1 << 16):
+    '''Iterate over `text.split('\n')` without building the whole list.
+
+    The lines are split off a block (of about `block` characters) at a time,
+    so only one block's worth of them exists at once.
+    '''
+
+    start = 0
+    while True:
+        end = text.find('\n', start + block)
+        if end < 0:
+            yield from text[start:].split('\n')
+            return
+        yield from text[start:end].split('\n')
+        start = end + 1
+
+def _split_lines(lines, start=1):
+    '''Like _split_text, but over any iterable of lines (such as a file).
+
+    `start` is the number of the first line.
+    '''
+
+    for line_num, line in enumerate(lines, start):
+        for token in _split_line(line):
+            yield (line_num, token)
+
+# Precompiled forms of `any(t in token for t in TERMINATORS)` and friends.
+_TERMINATOR_SEARCH = re.compile('|'.join(
+    map(re.escape, _resources.TERMINATORS))).search
+_NON_TERMINATOR_SEARCH = re.compile('|'.join(
+    map(re.escape, sorted(_resources.NON_TERMINATORS)))).search
+
+def _ends_sentence(token):
+    return bool(_TERMINATOR_SEARCH(token) and not _NON_TERMINATOR_SEARCH(token))
+
+class Stats(object):
+    '''Mergeable accumulator for the statistics that get_stats() reports.
+
+    A Stats holds raw counts for a run of text. `merge` adds in the counts of
+    the text that directly follows it, so that the merged Stats of a text's 
+    consecutive chunks (cut between any two tokens) equals the Stats of the 
+    whole text. `result` turns it into the stats dict.
+
+    With the `approximate` option, words are counted in bounded memory by 
+    `sketch` (a SpaceSaving) and `distinct` (a HyperLogLog) instead of in 
+    `tally`, and `syllables` are counted as the words go by. Word forms are 
+    then folded by _stem() alone, as there is no tally to check stems in.
+    '''
+
+    __slots__ = ('char_count', 'word_count', 'token_length', 'letter_count',
+                 'sentence_count', 'sentence_words', 'open_words', 'tally', 
+                 'sketch', 'distinct', 'syllables')
+
+    def __init__(self):
+        self.char_count = 0
+        self.word_count = 0
+        self.token_length = 0
+        self.letter_count = 0
+        self.sentence_count = 0
+        # Words in complete sentences, not counting empty tokens
+        self.sentence_words = 0
+        # Words after the last complete sentence
+        self.open_words = 0
+        # Occurrences of each stripped, lowercased token, in order of first
+        # occurrence
+        self.tally = {}
+        self.sketch = self.distinct = self.syllables = None
+
+    def merge(self, other):
+        '''Add the counts of `other`, the text following this one.'''
+
+        self.char_count += other.char_count
+        self.word_count += other.word_count
+        self.token_length += other.token_length
+        self.letter_count += other.letter_count
+        if other.sentence_count:
+            # Our unfinished sentence ends in the other text
+            self.sentence_words += self.open_words
+            self.open_words = 0
+        self.sentence_count += other.sentence_count
+        self.sentence_words += other.sentence_words
+        self.open_words += other.open_words
+        tally = self.tally
+        for word, count in other.tally.items():
+            if word in tally:
+                tally[word] += count
+            else:
+                tally[word] = count
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = SpaceSaving(other.sketch.capacity)
+                self.distinct = HyperLogLog(other.distinct.precision)
+                if other.syllables is not None:
+                    self.syllables = {}
+            self.sketch.merge(other.sketch)
+            self.distinct.merge(other.distinct)
+            for sylls, count in (other.syllables or {}).items():
+                self.syllables[sylls] = self.syllables.get(sylls, 0) + count
+        return self
+
+    def frequency(self):
+        '''Get the frequency of each word, folding in inflected forms.
+
+        Inflected forms (-s, -d, -ed, -es, 's, -ing) are counted under their
+        stems (see _stem()), as long as the stem itself occurs in the text; 
+        possessives always are. That way no word is counted that isn't there
+        ("during" is never "dure"), and it still makes no difference what 
+        order the words come in.
+        '''
+
+        tally = self.tally
+        frequency = {}
+        for word, count in tally.items():
+            stem = _stem(word)
+            if stem not in tally and not word.endswith(
+                                            _resources.POSSESSIVE_ENDINGS):
+                stem = word
+            frequency[stem] = frequency.get(stem, 0) + count
+        return frequency
+
+    def syllable_distribution(self):
+        if self.syllables is not None:
+            return dict(self.syllables)
         syllable_dist = {}
-    sentences = []
-    current_sen = []
-    frequency = {}
-    for token in split:
-        current_sen.append(token)
-        if any(t in token for t in _resources.TERMINATORS):
-            if not any(t in token for t in _resources.NON_TERMINATORS):
-                sentences.append(' '.join(current_sen))
-                current_sen = []
-        
-        #Frequency analysis
-        # @Note that if augmented forms appear before basic ones, they'll both
-        # be caught separately. Consider using a wordlist to improve this, e.g.
-        # http://www.sil.org/linguistics/wordlists/english/wordlist/wordsEn.txt
-        stoken = token.strip(_resources.PUNCTUATION).lower()
-        alnum_count += len(stoken)
+        for sylls, count in zip(_count_syllables_batch(self.tally),
+                                self.tally.values()):
+            syllable_dist[sylls] = syllable_dist.get(sylls, 0) + count
+        return syllable_dist
+
+    def result(self, indices=False, top_words=None):
+        '''Get the stats dict, as returned by get_stats().
+
+        'Top Twenty Words' has the `top_words` (by default, TOP_WORDS) 
+        commonest words. If they were counted approximately, 'Top Words 
+        Error' is the most any of their counts may be too high by.
+        '''
+
+        top_words = top_words or TOP_WORDS
+        if self.sketch is not None:
+            unique = self.distinct.count()
+            top = self.sketch.top(top_words)
+        else:
+            frequency = self.frequency()
+            unique = len(frequency)
+            top = heapq.nsmallest(top_words, frequency.items(), 
+                                  key=lambda x:(-x[1], x[0]))
+        stats = {
+                 'Word Count':self.word_count,
+                 'Character Count':self.char_count,
+                 'Average Word Length':self.token_length/float(
+                                                            self.word_count),
+                 'Average Sentence Length':self.sentence_words/float(
+                                                        self.sentence_count),
+                 'Letter Count':self.letter_count,
+                 'Sentence Count':self.sentence_count,
+                 'Unique Words':unique,
+                 'Top Twenty Words':top,
+                 }
+        if self.sketch is not None:
+            stats['Top Words Error'] = max([self.sketch.errors[word] 
+                                            for word, _ in top] or [0])
+        stats['Lexical Density'] = 100*(float(stats['Unique Words'])/
+                                        stats['Word Count'])
         if indices:
-            sylls = _count_syllables(stoken)
-            syllable_dist[sylls] = syllable_dist.get(sylls, 0) + 1
-        if stoken in frequency:
-            frequency[stoken] += 1
-        else: 
-            if stoken.endswith(('d','s')):
-                if stoken[:-1] in frequency:
-                    frequency[stoken[:-1]] += 1
-                    continue
-                elif stoken.endswith(('ed','es',"'s","\x92s")):
-                    if stoken[:-2] in frequency:
-                        frequency[stoken[:-2]] += 1
-                        continue
-            elif stoken.endswith('ing'):
-                if stoken[:-3] in frequency:
-                    frequency[stoken[:-3]] += 1
-                    continue
-            frequency[stoken] = 1
-    
-    stats['Letter Count'] = alnum_count
-    stats['Average Sentence Length'] = (sum(map(len,map(str.split,sentences)))/
-                                        float(len(sentences)))
-    stats['Sentence Count'] = len(sentences)
-    stats['Unique Words'] = len(frequency)
-    top_twenty = sorted(frequency.items(), key=lambda x:(-x[1], x[0]))[:20]
-    stats['Top Twenty Words'] = top_twenty
-    stats['Lexical Density'] = 100*(float(stats['Unique Words'])/
-                                    stats['Word Count'])
-    if indices:
+            self.add_syllables(stats)
+        return stats
+
+    def add_syllables(self, stats):
+        '''Add the syllable counts the indices need to a result() dict.'''
+
+        syllable_dist = self.syllable_distribution()
         stats['Syllable Distribution'] = syllable_dist
         stats['Syllable Count'] = sum(k*v for k, v in syllable_dist.items())
 
-    return stats
+def _process(tokens, opts, window=(), sentence=()):
+    '''Run the flag checks and gather statistics over `tokens` in one pass.
 
-def analyze(text, **opts):
-    proximity = opts.get('proximity', 0)
-    wthresh = opts.get('word_thresh', 17)
-    cthresh = opts.get('char_thresh', 95)
+    `tokens` is an iterable of `(line_num, token)` pairs, as from _split_text.
+    `opts` are the options to analyze(), plus `flags` and `stats` (both True 
+    by default) to skip either half of the work. `window` are the tokens just
+    before these ones, if any, to seed the proximity check with; `sentence`
+    are the tokens of the unfinished sentence they continue. (The statistics
+    only count the given tokens, so that the Stats can be merged.)
+
+    Returns a `(flags, stats)` pair: the sorted flags as from analyze(), and a
+    Stats (None if `stats` is off). Its `char_count` is left for the caller.
+    '''
+
+    flags, stats = _collect(_scan(tokens, opts, window, sentence))
+    flags.sort()
+    return flags, stats
+
+def _collect(scan):
+    '''Run a _scan() to the end. Returns its flags, in order, and Stats.'''
+
+    flags = []
+    append = flags.append
+    while True:
+        try:
+            append(next(scan))
+        except StopIteration as done:
+            return flags, done.value
+
+# Most distinct tokens _scan() interns before starting afresh, when it's
+# counting words approximately (in bounded memory).
+_INTERN_LIMIT = 1 << 18
+_NEVER = -(1 << 62) # Position of a word that hasn't been seen
+
+def _scan(tokens, opts, window=(), sentence=()):
+    '''The generator behind _process(), yielding flags as they are found.
+
+    Flags come in document order, and the Stats (or None) is the return 
+    value. With a `max_flags` option, flagging stops after that many; if 
+    `stats` is off, so does the whole scan.
+
+    Each distinct token is only stripped, lowercased and checked for a 
+    sentence end once: it is interned as the integer ID of its stripped, 
+    lowercased word, and everything kept per word (whether it's common, 
+    where it was last seen, how often it occurs) is kept in arrays by ID.
+    '''
+
+    do_flags = opts.get('flags', True)
+    do_stats = opts.get('stats', True)
+    proximity = opts.get('proximity', 0) if do_flags else 0
+    wthresh = opts.get('word_thresh', 17) if do_flags else 0
+    cthresh = opts.get('char_thresh', 95) if do_flags else 0
+    max_flags = opts.get('max_flags') or -1 # Never reached if not given
+    found = 0
     _common_word_set = _resources.common_words(**opts)
+    punctuation = _resources.PUNCTUATION
     
-    problem_phrases = []
-    last_n_simple_tokens = collections.deque([], proximity)
-    last_n_tokens = collections.deque([], proximity+1)
-    current_sentence = []
+    # Each token's code: its word's ID, times two, plus one if it ends a 
+    # sentence. The words, and what's known of them, by ID:
+    codes = {}
+    word_ids = {}
+    words = []
+    common = bytearray()
+    letters = array.array('I')
+    counts = array.array('I')
+    # Where each word was last seen, so that the proximity check needn't
+    # search the window: it's a repeat if seen within `proximity` tokens.
+    last_seen = array.array('q')
+
+    def intern(token):
+        simpletoken = token.strip(punctuation).lower()
+        word_id = word_ids.get(simpletoken)
+        if word_id is None:
+            word_id = word_ids[simpletoken] = len(words)
+            words.append(simpletoken)
+            common.append(simpletoken in _common_word_set)
+            letters.append(len(simpletoken))
+            counts.append(0)
+            last_seen.append(_NEVER)
+        code = codes[token] = 2*word_id + bool(_TERMINATOR_SEARCH(token) and 
+                                               not _NON_TERMINATOR_SEARCH(token))
+        return code
+
+    last_n_tokens = collections.deque(window, proximity+1)
+    position = 0
+    for i, t in enumerate(window):
+        last_seen[intern(t) >> 1] = i - len(window)
+    current_sentence = list(sentence)
+
+    word_count = 0
+    token_length = 0
+    alnum_count = 0
+    sentence_count = 0
+    # The words in `sentence` are counted by whoever counted those tokens
+    carried = len(current_sentence) - current_sentence.count('')
+    sentence_words = -carried
+    sketch = distinct = syllables = None
+    if do_stats and opts.get('approximate'):
+        sketch = SpaceSaving(opts['approximate'])
+        distinct = HyperLogLog()
+        if opts.get('indices'):
+            syllables = {}
     
-    for line_num, token in _split_text(text):
-        simpletoken = token.strip(_resources.PUNCTUATION).lower()
+    for line_num, token in tokens:
+        code = codes.get(token)
+        if code is None:
+            if sketch is not None and len(codes) >= _INTERN_LIMIT:
+                # Start afresh, remembering just the words still in range
+                codes.clear()
+                word_ids.clear()
+                del words[:], common[:], letters[:], counts[:], last_seen[:]
+                start = position - len(last_n_tokens)
+                for i, t in enumerate(last_n_tokens):
+                    last_seen[intern(t) >> 1] = start + i
+            code = intern(token)
+        word_id = code >> 1
         if proximity:
             last_n_tokens.append(token)
-            if simpletoken not in _common_word_set:
-                if simpletoken in last_n_simple_tokens:
-                    problem_phrases.append((PROXIMITY_FLAG,line_num,simpletoken, 
-                                           ' '.join(last_n_tokens)))
-            last_n_simple_tokens.append(simpletoken)
+            if (not common[word_id] and 
+                position - last_seen[word_id] <= proximity):
+                yield (PROXIMITY_FLAG, line_num, words[word_id], 
+                       ' '.join(last_n_tokens))
+                found += 1
+                if found == max_flags:
+                    proximity = wthresh = cthresh = 0
+            last_seen[word_id] = position
+            position += 1
         current_sentence.append(token)
-        if any(t in token for t in _resources.TERMINATORS):
-            if not any(t in token for t in _resources.NON_TERMINATORS):
-                # End of sentence; check for problems.
-                if wthresh and len(current_sentence) >= wthresh:
-                    problem_phrases.append((WTHRESH_FLAG, line_num, 
-                                           len(current_sentence),
-                                           ' '.join(current_sentence)))
-                if cthresh:
-                    lsen = sum(len(w) for w in current_sentence)
-                    if lsen > cthresh:
-                        problem_phrases.append((CTHRESH_FLAG, line_num, lsen, 
-                                               ' '.join(current_sentence)))
-                # Reset current sentence
-                current_sentence = []
-    problem_phrases.sort()
-    return problem_phrases
+        if code & 1:
+            # End of sentence; check for problems.
+            if wthresh and len(current_sentence) >= wthresh:
+                yield (WTHRESH_FLAG, line_num, len(current_sentence),
+                       ' '.join(current_sentence))
+                found += 1
+                if found == max_flags:
+                    proximity = wthresh = cthresh = 0
+            if cthresh:
+                lsen = sum(map(len, current_sentence))
+                if lsen > cthresh:
+                    yield (CTHRESH_FLAG, line_num, lsen, 
+                           ' '.join(current_sentence))
+                    found += 1
+                    if found == max_flags:
+                        proximity = wthresh = cthresh = 0
+            if do_stats:
+                # Empty tokens (e.g. from "a--") don't count as words here.
+                sentence_count += 1
+                sentence_words += (len(current_sentence) - 
+                                   current_sentence.count(''))
+            # Reset current sentence
+            current_sentence = []
+        
+        if not do_stats:
+            if found == max_flags:
+                break # Nothing more to look for
+            continue
+        token_length += len(token)
+        alnum_count += letters[word_id]
+
+        if sketch is not None:
+            simpletoken = words[word_id]
+            stem = _stem(simpletoken)
+            if stem not in sketch.counts:
+                distinct.add(stem)
+            sketch.add(stem)
+            if syllables is not None:
+                sylls = _count_syllables(simpletoken)
+                syllables[sylls] = syllables.get(sylls, 0) + 1
+            word_count += 1
+            continue
+
+        #Frequency analysis (see Stats.frequency)
+        counts[word_id] += 1
+        word_count += 1
+
+    if not do_stats:
+        return None
+    stats = Stats()
+    stats.word_count = word_count
+    stats.token_length = token_length
+    stats.letter_count = alnum_count
+    stats.sentence_count = sentence_count
+    stats.sentence_words = sentence_words
+    stats.open_words = len(current_sentence) - current_sentence.count('')
+    if not sentence_count:
+        stats.sentence_words = 0
+        stats.open_words -= carried
+    if sketch is None:
+        stats.tally = {word: count for word, count in zip(words, counts) 
+                       if count}
+    stats.sketch = sketch
+    stats.distinct = distinct
+    stats.syllables = syllables
+    return stats
+
+def _sectioned(opts):
+    '''Whether the options ask for stats by section.'''
+
+    return bool(opts.get('section_pattern') or opts.get('section_gap'))
+
+def lint(text, profiler=None, **opts):
+    '''Flag problems in the text and gather its statistics, in a single pass.
+
+    Takes the same options as analyze(), plus `stats` (default True) and 
+    `indices` as for get_stats(). Returns a `(flags, stats)` pair; `stats` is
+    empty if `stats` is off.
+
+    Given a prosl_profile.Profiler, the work is done in separate phases that
+    it times: tokenizing, the pass over the tokens, and the statistics.
+
+    With a `section_pattern` (a regular expression for heading lines) or a
+    `section_gap` (a number of blank lines), the stats are also broken down
+    by section, in the same pass; see _lint_sections().
+    '''
+
+    if _sectioned(opts):
+        with _phase(profiler, 'lint sections'):
+            return _lint_sections(_with_endings(_iter_lines(text)), opts)
+    if profiler is not None:
+        return _lint_phases(text, profiler, opts)
+    flags, stats = _process(_split_text(text), opts)
+    if stats is None:
+        return flags, {}
+    stats.char_count = len(text)
+    return flags, stats.result(opts.get('indices', False), 
+                               opts.get('top_words'))
+
+def _lint_phases(text, profiler, opts):
+    '''lint(), one phase at a time.'''
+
+    indices = opts.get('indices', False) and opts.get('stats', True)
+    if indices and not SYLLABLE_LOOKUP.loaded:
+        with profiler.phase('load dictionary'):
+            SYLLABLE_LOOKUP.load()
+    with profiler.phase('tokenize') as phase:
+        tokens = list(_split_text(text))
+        phase.tokens = len(tokens)
+    with profiler.phase('analyze', len(tokens)):
+        flags, stats = _process(tokens, opts)
+    if stats is None:
+        return flags, {}
+    stats.char_count = len(text)
+    with profiler.phase('get_stats', len(tokens)):
+        result = stats.result(top_words=opts.get('top_words'))
+    if indices:
+        with profiler.phase('indices', len(tokens)):
+            stats.add_syllables(result)
+    return flags, result
+
+def lint_lines(lines, **opts):
+    '''Like lint(), but reads the text lazily from an iterable of lines.
+
+    `lines` should keep their line endings, as when iterating over a file, so
+    that the character count is right. Only one line and the current sentence
+    are held at a time, so an open file (or sys.stdin) of any size can be 
+    linted in memory bounded by its vocabulary and longest sentence.
+    '''
+
+    if _sectioned(opts):
+        return _lint_sections(lines, opts)
+    char_count = [0]
+    def counted():
+        for line in lines:
+            char_count[0] += len(line)
+            yield line
+
+    flags, stats = _process(_split_lines(counted()), opts)
+    if stats is None:
+        return flags, {}
+    stats.char_count = char_count[0]
+    return flags, stats.result(opts.get('indices', False), 
+                               opts.get('top_words'))
+
+def _with_endings(lines):
+    '''Put the line breaks back on the lines from _iter_lines().'''
+
+    lines = iter(lines)
+    line = next(lines)
+    for following in lines:
+        yield line + '\n'
+        line = following
+    yield line
+
+def _split_sections(lines, heading=None, gap=0):
+    '''Group the lines into sections.
+
+    A section starts at a line that `heading` (a regex's match()) matches, or
+    at the first line after a run of at least `gap` blank lines; blank lines
+    go with the section before them. Yields `(title, start_line, lines)` for
+    each section, where `title` is its first non-blank line, stripped.
+    '''
+
+    section = []
+    title = None
+    start = 1
+    blanks = 0
+    for line_num, line in enumerate(lines, 1):
+        stripped = line.strip()
+        if not stripped:
+            blanks += 1
+        else:
+            if title is not None and (0 < gap <= blanks or 
+                                      heading is not None and heading(line)):
+                yield (title, start, section)
+                section = []
+                title = None
+                start = line_num
+            if title is None:
+                title = stripped
+            blanks = 0
+        section.append(line)
+    yield (title or '', start, section)
+
+def _next_state(tokens, window=(), sentence=(), proximity=0):
+    '''Get the `(window, sentence)` to _scan() the text after `tokens` with.
+
+    `tokens` are the text's tokens (without line numbers), which were 
+    scanned with `window` and `sentence` as for _process().
+    '''
+
+    tokens = tuple(tokens)
+    if proximity:
+        window = (tuple(window) + tokens)[-proximity:]
+    for i in range(len(tokens) - 1, -1, -1):
+        if _ends_sentence(tokens[i]):
+            return (window, tokens[i + 1:])
+    return (window, tuple(sentence) + tokens)
+
+def _proximity(opts):
+    '''Get the proximity the flag checks use: none if flags are off.'''
+
+    return opts.get('proximity', 0) if opts.get('flags', True) else 0
+
+class _Merger(object):
+    '''Puts the results of a text's pieces back together, in order.
+
+    Each piece's flags (in document order) and Stats are `add`ed in turn. 
+    `finish` then picks out the first `max_flags` flags and sorts them, as 
+    lint() does, and `result` also turns the merged Stats into the stats 
+    dict.
+    '''
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.max_flags = opts.get('max_flags') or 0
+        self.flags = []
+        self.stats = Stats() if opts.get('stats', True) else None
+
+    def add(self, flags, stats):
+        self.flags.extend(flags)
+        if self.stats is not None:
+            self.stats.merge(stats)
+
+    @property
+    def done(self):
+        '''Whether there's no need for more pieces (only flags are wanted,
+        and there are enough of them).'''
+
+        return self.stats is None and 0 < self.max_flags <= len(self.flags)
+
+    def finish(self, char_count=None):
+        '''Get the sorted flags and the merged Stats (or None).
+
+        `char_count` is the whole text's, if the pieces' Stats don't have it.
+        '''
+
+        flags = self.flags
+        if self.max_flags > 0:
+            del flags[self.max_flags:]
+        flags.sort()
+        if self.stats is not None and char_count is not None:
+            self.stats.char_count = char_count
+        return flags, self.stats
+
+    def result(self, char_count=None):
+        '''Get the `(flags, stats)` pair, as from lint().'''
+
+        flags, stats = self.finish(char_count)
+        if stats is None:
+            return flags, {}
+        return flags, stats.result(self.opts.get('indices', False), 
+                                   self.opts.get('top_words'))
+
+def _compile_section_pattern(pattern):
+    '''Compile a `section_pattern`. Raises ValueError if it isn't valid.'''
+
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ValueError('Bad section pattern {!r}: {!s}'.format(pattern, e))
+
+def _lint_sections(lines, opts):
+    '''lint_lines(), with the stats of each section as well as the totals.
+
+    Sections are found by the `section_pattern` and `section_gap` options, 
+    as by _split_sections(). Each section is scanned once, carrying on from 
+    the one before as lint_parallel() does with its pieces, and the totals
+    are its Stats merged; the flags and totals come out the same as from 
+    lint(), except that with `approximate` the top words and their error 
+    come from merged sketches, and may differ from lint()'s estimates. The 
+    totals have a 'Sections' list of `{'Title', 'Line', 'Stats'}` dicts, 
+    whose 'Stats' are empty for a section with no complete sentences to go 
+    by. Raises ValueError if `section_pattern` isn't a valid regular 
+    expression.
+    '''
+
+    pattern = opts.get('section_pattern')
+    heading = _compile_section_pattern(pattern).match if pattern else None
+    proximity = _proximity(opts)
+    merger = _Merger(opts)
+    sections = []
+    state = ((), ())
+    for title, start_line, section in _split_sections(
+                        lines, heading, opts.get('section_gap') or 0):
+        tokens = list(_split_lines(section, start_line))
+        section_flags, stats = _collect(_scan(tokens, opts, *state))
+        if stats is not None:
+            stats.char_count = sum(map(len, section))
+            try:
+                result = stats.result(opts.get('indices', False), 
+                                      opts.get('top_words'))
+            except ZeroDivisionError:
+                result = {}
+            sections.append({'Title': title, 'Line': start_line, 
+                             'Stats': result})
+        merger.add(section_flags, stats)
+        if merger.done:
+            break # Nothing more to look for
+        state = _next_state((token for _, token in tokens), *state, 
+                            proximity=proximity)
+    flags, stats = merger.result()
+    if stats:
+        stats['Sections'] = sections
+    return flags, stats
+
+def _chunk_text(text, size, encoding=None):
+    '''Cut the text into pieces of roughly `size` characters.
+
+    Pieces only end at line breaks that follow the end of a sentence, so no 
+    sentence is split. Yields `(start_line, start, end)` for each piece, where
+    `start` and `end` are offsets into the text.
+
+    The text may also be bytes (such as an mmap of a file) in an `encoding`
+    that encodes "\n" as itself; sizes and offsets are then in bytes.
+    '''
+
+    newline = '\n' if encoding is None else b'\n'
+    start = 0
+    start_line = 1
+    while start < len(text):
+        end = len(text)
+        nl = text.find(newline, start + size)
+        while nl >= 0:
+            line = text[text.rfind(newline, 0, nl) + 1:nl]
+            tokens = _split_line(line if encoding is None else
+                                 line.decode(encoding))
+            if tokens and _ends_sentence(tokens[-1]):
+                end = nl + 1
+                break
+            nl = text.find(newline, nl + 1)
+        # Counted first, so the caller is done with this piece once it's had it
+        lines = (text.count(newline, start, end) if encoding is None 
+                 else text[start:end].count(newline)) # No mmap.count()
+        yield (start_line, start, end)
+        start_line += lines
+        start = end
+
+def _window_before(text, end, size):
+    '''Get (up to) the last `size` tokens of the text before offset `end`.'''
+
+    window = []
+    while end > 0 and len(window) < size:
+        start = text.rfind('\n', 0, end - 1) + 1
+        window[:0] = _split_line(text[start:end])
+        end = start
+    return window[-size:] if size else []
+
+def _decode_chunk(chunk, encoding):
+    '''Decode part of a file, with line endings as from open(filename, 'r').
+    '''
+
+    text = chunk.decode(encoding)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def _lint_chunk(chunk, start_line, window, opts):
+    '''Scan one piece of a text, for lint_parallel().
+
+    Flags are left in document order, so that the first `max_flags` of the
+    whole text can be picked out once the pieces are put back together.
+    '''
+
+    return _collect(_scan(_split_lines(chunk.split('\n'), start_line), opts,
+                          window))
+
+def lint_parallel(text, jobs=None, chunk_size=None, **opts):
+    '''Like lint(), but splits the text up over up to `jobs` processes.
+
+    The text is cut between sentences into pieces of about `chunk_size` 
+    characters (by default, enough for four pieces per worker, but no smaller
+    than 64K). Each piece is seeded with the tokens before it, so proximity 
+    flags across the cuts are found, and the pieces' Stats are merged in 
+    order. The result is the same as from lint(). Stats by section are 
+    gathered by lint() itself, in this process.
+    '''
+
+    if _sectioned(opts):
+        return lint(text, **opts)
+    jobs = jobs or os.cpu_count() or 1
+    chunk_size = chunk_size or max(len(text)//(4*jobs), 1 << 16)
+    proximity = _proximity(opts)
+    merger = _Merger(opts)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = [executor.submit(_lint_chunk, text[start:end], start_line,
+                                   _window_before(text, start, proximity), 
+                                   opts)
+                   for start_line, start, end in _chunk_text(text, chunk_size)]
+        for future in futures:
+            merger.add(*future.result())
+    return merger.result(len(text))
+
+# Biggest piece lint_file_parallel() cuts a file into by default, in bytes
+_MAX_CHUNK_SIZE = 1 << 22
+
+def lint_file_parallel(filename, jobs=None, chunk_size=None, **opts):
+    '''Like lint_parallel() over the named file, without reading it all in.
+
+    The file is memory-mapped and cut into pieces of about `chunk_size` bytes
+    (by default, four per worker, but from 64K to 4M), and each piece is only
+    decoded when it is handed out. No more than two pieces per worker are out
+    at once, so memory use doesn't grow with the size of the file. Line 
+    numbers and the result are the same as from lint_file().
+
+    The file is read in the locale's encoding, as by open(). Files in an 
+    encoding that doesn't keep "\n" as it is (such as UTF-16) are read in
+    whole and given to lint_parallel() instead. Stats by section are 
+    gathered by lint_file() itself, in this process.
+    '''
+
+    if _sectioned(opts):
+        return lint_file(filename, **opts)
+    jobs = jobs or os.cpu_count() or 1
+    encoding = locale.getpreferredencoding(False)
+    if '\r\n'.encode(encoding) != b'\r\n':
+        with open(filename, 'r') as f:
+            return lint_parallel(f.read(), jobs, chunk_size, **opts)
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+    try:
+        return _lint_mapped(buf, encoding, jobs, chunk_size or min(
+                                max(size//(4*jobs), 1 << 16), _MAX_CHUNK_SIZE),
+                            opts)
+    finally:
+        if size:
+            buf.close()
+
+def _lint_mapped(buf, encoding, jobs, chunk_size, opts):
+    '''lint_file_parallel(), over the mapped file.'''
+
+    proximity = _proximity(opts)
+    merger = _Merger(opts)
+    char_count = 0
+    start_line = 1
+    window = []
+    pending = collections.deque()
+    # Pages of the file that have been handed out can be dropped from memory
+    release = (buf.madvise if hasattr(mmap, 'MADV_DONTNEED') and 
+               isinstance(buf, mmap.mmap) else None)
+    released = 0
+    def collect():
+        merger.add(*pending.popleft().result())
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        for _, start, end in _chunk_text(buf, chunk_size, encoding):
+            if len(pending) >= 2*jobs:
+                collect()
+            if merger.done:
+                break # Nothing more to look for
+            chunk = _decode_chunk(buf[start:end], encoding)
+            pending.append(executor.submit(_lint_chunk, chunk, start_line,
+                                           window, opts))
+            char_count += len(chunk)
+            start_line += chunk.count('\n')
+            if release is not None:
+                done = end - end % mmap.PAGESIZE
+                if done > released:
+                    release(mmap.MADV_DONTNEED, released, done - released)
+                    released = done
+            if proximity:
+                window = (window + _window_before(chunk, len(chunk), 
+                                                  proximity))[-proximity:]
+        while pending:
+            collect()
+    return merger.result(char_count)
+
+def lint_file(filename, profiler=None, **opts):
+    '''lint_lines() over the named file, or standard input if it is "-".
+
+    With a `profiler`, the file is read in first, as its own phase, and then
+    profiled as by lint().
+    '''
+
+    if profiler is not None:
+        with profiler.phase('read'):
+            if filename == '-':
+                text = sys.stdin.read()
+            else:
+                with open(filename, 'r') as f:
+                    text = f.read()
+        return lint(text, profiler, **opts)
+    if filename == '-':
+        return lint_lines(sys.stdin, **opts)
+    with open(filename, 'r') as f:
+        return lint_lines(f, **opts)
+
+def _lint_job(filename, opts, text=None):
+    '''Run lint_file(), for lint_files(). Errors are returned, not raised.
+
+    If the `text` of the file is given, that is linted instead of reading it.
+    '''
+
+    try:
+        if text is not None:
+            return (filename,) + lint(text, **opts) + (None,)
+        return (filename,) + lint_file(filename, **opts) + (None,)
+    except (IOError, ValueError) as e:
+        return (filename, None, None, e)
+    except ZeroDivisionError:
+        # No words or no complete sentences; there are no stats to give.
+        return (filename, None, None, ValueError('Nothing to analyze'))
+
+def lint_files(filenames, jobs=None, cache=None, executor=None, **opts):
+    '''Lint many files, spreading them over up to `jobs` worker processes.
+
+    `jobs` defaults to the number of CPUs; with `jobs=1` everything is done in
+    this process. Yields `(filename, flags, stats, error)` in the order of 
+    `filenames`. If a file couldn't be read or linted, `error` is the 
+    exception and `flags` and `stats` are None.
+
+    If a `cache` (a prosl_cache.ResultCache) is given, files whose results 
+    are already in it aren't linted again, and new results are added to it.
+    An `executor` (such as a ProcessPoolExecutor that is kept running between
+    calls) is used instead of starting up a new pool.
+    '''
+
+    filenames = list(filenames)
+    keys = [None]*len(filenames)
+    hits = {}
+    if cache is not None:
+        for i, filename in enumerate(filenames):
+            if filename == '-':
+                continue
+            try:
+                keys[i] = cache.file_key(filename, opts)
+            except IOError:
+                continue # Reported when the lint job tries to read it
+            hit = cache.get(keys[i])
+            if hit is not None:
+                hits[i] = (filename,) + tuple(hit) + (None,)
+    results = _lint_jobs([filename for i, filename in enumerate(filenames) 
+                          if i not in hits], jobs, opts, executor)
+    for i, key in enumerate(keys):
+        if i in hits:
+            yield hits[i]
+            continue
+        result = next(results)
+        if key is not None and result[3] is None:
+            cache.put(key, result[1], result[2])
+        yield result
+
+def _lint_jobs(filenames, jobs, opts, executor=None):
+    '''Yield _lint_job() for each file in turn, using a process pool.'''
+
+    if executor is None and (jobs == 1 or len(filenames) < 2):
+        for filename in filenames:
+            yield _lint_job(filename, opts)
+        return
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+    futures = []
+    try:
+        # Standard input belongs to this process, so read it here.
+        futures = [None if filename == '-' else 
+                   executor.submit(_lint_job, filename, opts)
+                   for filename in filenames]
+        for filename, future in zip(filenames, futures):
+            yield (_lint_job(filename, opts) if future is None 
+                   else future.result())
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+        else:
+            # Don't leave work for a shared executor that nobody will collect
+            for future in futures:
+                if future is not None:
+                    future.cancel()
+
+def _expand_paths(paths, include='*.txt'):
+    '''Expand directories and glob patterns into a list of filenames.
+
+    Directories are searched recursively for files matching `include`. Paths
+    that match nothing are kept as they are, so that they get reported as 
+    unreadable rather than silently dropped.
+    '''
+
+    filenames = []
+    for path in paths:
+        if path == '-' or os.path.isfile(path):
+            filenames.append(path)
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                filenames.extend(os.path.join(root, name) for name in 
+                                 sorted(fnmatch.filter(files, include)))
+        else:
+            filenames.extend(sorted(glob.glob(path, recursive=True)) or [path])
+    return filenames
+
+def get_stats(text, indices=False):
+    '''Get a bunch of statistics about the text.'''
+    
+    return lint(text, flags=False, indices=indices)[1]
+
+def analyze(text, **opts):
+    return _process(_split_text(text), dict(opts, stats=False))[0]
+
+def analyze_iter(text, reorder=0, **opts):
+    '''Like analyze(), but yields each flag as soon as it is found.
+
+    Flags come in document order, so the first ones are ready right away,
+    and the rest aren't looked for if the caller stops early. Give `reorder`
+    to put them in analyze()'s (type-major) order instead, as far as a
+    buffer of that many flags can: the order is exact if there are no more
+    flags than that, and the first flag is held back until the buffer fills.
+    '''
+
+    flags = _scan(_split_text(text), dict(opts, stats=False))
+    return _reorder(flags, reorder) if reorder else flags
+
+def _reorder(flags, size):
+    '''Sort `flags` as they go by, holding up to `size` of them at a time.'''
+
+    heap = []
+    for flag in flags:
+        if len(heap) < size:
+            heapq.heappush(heap, flag)
+        else:
+            yield heapq.heappushpop(heap, flag)
+    while heap:
+        yield heapq.heappop(heap)
 
 def _format_flag(flag):
     '''Format a single flag in a human-readable way.
@@ -246,9 +1201,12 @@ def _format_flag(flag):
                 'in the following sentence: "{3}"').format(*flag)
     return str(flag)
  
-def _format_stats(stats, indices=False):
+def _format_stats(stats, indices=False, top_words=None):
     '''
     '''
+    top_words = top_words or TOP_WORDS
+    top_label = ('Top Twenty Words:   ' if top_words == 20 else 
+                 '{:<20}'.format('Top {:d} Words:'.format(top_words)))
     s = '\n'.join(['Character Count:\t\t\t{:d}',
                   'Letter Count:   \t\t\t{:d}',
                   'Word Count: \t\t\t\t{:d}',
@@ -256,7 +1214,7 @@ def _format_stats(stats, indices=False):
                   'Average Sentence Length:\t{:.2f} words',
                   'Average Word Length:\t\t{:.2f} characters',
                   'Unique Words:   \t\t\t{:d}',
-                  'Top Twenty Words:   \t\t{:s}',
+                  top_label + '\t\t{:s}',
                   'Lexical Density:\t\t\t{:.1f}%\n'])
     vals = [stats['Character Count'],
             stats['Letter Count'],
@@ -266,7 +1224,10 @@ def _format_stats(stats, indices=False):
             stats['Average Word Length'], 
             stats['Unique Words'], 
             ', '.join(map(lambda x:x[0]+' ('+str(x[1])+')',
-                          stats['Top Twenty Words'])),
+                          stats['Top Twenty Words'])) + 
+            (' (approximate; counts may be up to {:d} too high)'.format(
+                stats['Top Words Error']) if 'Top Words Error' in stats 
+             else ''),
             stats['Lexical Density']]
     if indices:
         s += ('Indices:\n'
@@ -299,27 +1260,238 @@ def _get_flag_desc(**opts):
                                                                 proximity-1))
     return s.format(', or '.join(args))
 
-def write_results(flags, statistics, **opts):
-    out = sys.stdout
+def _write_report(out, flags, statistics, **opts):
+    if flags:
+        out.writelines(_format_flag(flag) + '\n' for flag in flags)
+    else:
+        out.write('\n')
+    print('Total number of flags:\t{}'.format(len(flags)), file=out)
+    print(_get_flag_desc(**opts), file=out)
+    if statistics:
+        print('\n\n### Stats ###\n\n', file=out)
+        print(_format_stats(statistics, opts.get('indices'), 
+                            opts.get('top_words')), file=out)
+        for section in statistics.get('Sections', ()):
+            print('\n### Line {:d}: {} ###\n\n'.format(section['Line'], 
+                                                     section['Title']), 
+                  file=out)
+            print(_format_stats(section['Stats'], opts.get('indices'), 
+                                opts.get('top_words')) 
+                  if section['Stats'] else 'Nothing to analyze.\n', file=out)
+
+def _format_summary(summary):
+    '''Format the corpus-wide totals from write_batch_results().'''
+
+    s = ['Files:  \t\t\t\t{:d} ({:d} skipped)'.format(
+            summary['Files'], summary['Skipped Files']),
+         'Total number of flags:\t{:d}'.format(summary['Total Flags'])]
+    for key in ('Character Count', 'Letter Count', 'Word Count', 
+                'Sentence Count'):
+        if key in summary:
+            s.append('{:<16}\t\t\t{:d}'.format(key + ':', summary[key]))
+    return '\n'.join(s)
+
+def _record_stats(stats, indices=False):
+    '''Get the stats for a jsonl or csv report, with the indices if wanted.'''
+
+    stats = dict(stats)
+    if indices and stats:
+        stats['Gunning-Fog Index'] = _gunning_fog_index(stats)
+        stats['Coleman-Liau Index'] = _coleman_liau_index(stats)
+        stats['Flesch-Kincaid Index'] = _flesch_kincaid_index(stats)
+    if 'Sections' in stats:
+        stats['Sections'] = [dict(section, Stats=_record_stats(
+                                                section['Stats'], indices))
+                             for section in stats['Sections']]
+    return stats
+
+class _TextWriter(object):
+    '''Writes results as the human-readable report.
+
+    The writers all work the same way: report() writes one text's flags and
+    stats. In a batch, each file's report() or error() comes between
+    begin(filename) and end(), and summary() writes the totals at the end.
+    '''
+
+    def __init__(self, out, opts):
+        self.out = out
+        self.opts = opts
+
+    def begin(self, filename):
+        print('##### {} #####\n'.format(filename), file=self.out)
+
+    def end(self):
+        print(file=self.out)
+
+    def report(self, flags, statistics):
+        _write_report(self.out, flags, statistics, **self.opts)
+
+    def error(self, filename, error):
+        if isinstance(error, IOError):
+            print('Unable to read file "{}".'.format(filename), file=self.out)
+        else:
+            print('Unable to lint file "{}": {!s}'.format(filename, error), 
+                  file=self.out)
+
+    def summary(self, summary):
+        print('\n### Summary ###\n\n', file=self.out)
+        print(_format_summary(summary), file=self.out)
+
+class _JsonlWriter(object):
+    '''Writes results as JSON Lines: one object per flag, then the stats.
+
+    Flags are `{"type": ..., "line": ..., "value": ..., "snippet": ...}`,
+    where the type is a FLAG_NAMES value. The stats, errors and summary are
+    `{"type": "stats", "stats": {...}}`, `{"type": "error", "message": ...}`
+    and `{"type": "summary", "summary": {...}}`. In a batch, every object
+    also has the "file" it is about.
+    '''
+
+    def __init__(self, out, opts):
+        self.out = out
+        self.indices = opts.get('indices')
+        self.filename = None
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def begin(self, filename):
+        self.filename = filename
+
+    def end(self):
+        self.filename = None
+
+    def _write(self, record):
+        if self.filename is not None:
+            record = dict(file=self.filename, **record)
+        self.out.write(self._encode(record) + '\n')
+
+    def report(self, flags, statistics):
+        encode = self._encode
+        # Flags are formatted directly, since there may be millions of them
+        start = ('{' if self.filename is None else 
+                 '{{"file": {}, '.format(encode(self.filename)))
+        self.out.writelines(
+                '{}"type": {}, "line": {:d}, "value": {}, "snippet": {}}}\n'
+                ''.format(start, encode(FLAG_NAMES.get(flag[0], flag[0])),
+                          flag[1], encode(flag[2]), encode(flag[3]))
+                for flag in flags)
+        if statistics:
+            self._write({'type': 'stats', 
+                         'stats': _record_stats(statistics, self.indices)})
+
+    def error(self, filename, error):
+        self._write({'type': 'error', 'message': str(error)})
+
+    def summary(self, summary):
+        self._write({'type': 'summary', 'summary': summary})
+
+class _CsvWriter(object):
+    '''Writes results as CSV, with a row per flag and then one per stat.
+
+    The columns are CSV_COLUMNS. Flag rows are as for _JsonlWriter. A stat
+    row has the type "stat", the stat's value (as JSON if it is a list or
+    dict), and its name as the snippet; summary rows are the same but with
+    the type "summary", and error rows have the message as the snippet.
+    '''
+
+    def __init__(self, out, opts):
+        self.indices = opts.get('indices')
+        self.filename = ''
+        self._writer = csv.writer(out, lineterminator='\n')
+        self._writer.writerow(CSV_COLUMNS)
+
+    def begin(self, filename):
+        self.filename = filename
+
+    def end(self):
+        self.filename = ''
+
+    def _write_values(self, row_type, values):
+        self._writer.writerows(
+            (self.filename, row_type, '', 
+             json.dumps(value) if isinstance(value, (list, dict)) else value,
+             name)
+            for name, value in values.items())
+
+    def report(self, flags, statistics):
+        filename = self.filename
+        self._writer.writerows((filename, FLAG_NAMES.get(flag[0], flag[0]), 
+                                flag[1], flag[2], flag[3]) for flag in flags)
+        if statistics:
+            self._write_values('stat', _record_stats(statistics, 
+                                                     self.indices))
+
+    def error(self, filename, error):
+        self._writer.writerow((filename, 'error', '', '', str(error)))
+
+    def summary(self, summary):
+        self._write_values('summary', summary)
+
+_WRITERS = {'text': _TextWriter, 'jsonl': _JsonlWriter, 'csv': _CsvWriter}
+
+def _open_output(opts):
+    '''Get a buffered stream for the `out_file`, or stdout if there is none.
+    '''
+
     if opts.get('out_file'):
         try:
-            f = open(os.path.abspath(opts['out_file']), 'w', encoding='utf-8')
-            out = f
+            return open(os.path.abspath(opts['out_file']), 'w', 
+                        encoding='utf-8', buffering=_OUTPUT_BUFFER)
         except IOError:
-            print('Error writing to file')
+            print('Error writing to file', file=sys.stderr)
+    return sys.stdout
+
+def write_results(flags, statistics, **opts):
+    '''Write the flags and stats, in the `format` given (text by default).
+
+    Flags are written out one by one, so the report is never built up in 
+    memory.
+    '''
+
+    out = _open_output(opts)
     try:
-        print('\n'.join(map(_format_flag,flags)), file=out)
-        print('Total number of flags:\t{}'.format(len(flags)), file=out)
-        print(_get_flag_desc(**opts), file=out)
-        if statistics:
-            print('\n\n### Stats ###\n\n', file=out)
-            print(_format_stats(statistics, opts.get('indices')), file=out)
+        _WRITERS[opts.get('format') or 'text'](out, opts).report(flags, 
+                                                                 statistics)
     except IOError:
-        print('Error writing to file')
+        print('Error writing to file', file=sys.stderr)
     finally:
-        if opts.get('out_file'):
+        if out is not sys.stdout:
             out.close()
 
+def write_batch_results(results, **opts):
+    '''Write each file's results, then totals for the whole batch.
+
+    `results` are `(filename, flags, stats, error)` tuples as from 
+    lint_files(); they are written as they arrive, in the `format` given as
+    for write_results(). Returns the totals.
+    '''
+
+    summary = {'Files':0, 'Skipped Files':0, 'Total Flags':0}
+    out = _open_output(opts)
+    try:
+        writer = _WRITERS[opts.get('format') or 'text'](out, opts)
+        for filename, flags, stats, error in results:
+            summary['Files'] += 1
+            writer.begin(filename)
+            if error is not None:
+                writer.error(filename, error)
+                writer.end()
+                summary['Skipped Files'] += 1
+                continue
+            writer.report(flags, stats)
+            writer.end()
+            summary['Total Flags'] += len(flags)
+            for key in ('Character Count', 'Letter Count', 'Word Count', 
+                        'Sentence Count'):
+                if key in stats:
+                    summary[key] = summary.get(key, 0) + stats[key]
+        writer.summary(summary)
+    except IOError:
+        print('Error writing to file', file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return summary
+
 def _arg_parser():
     '''
     TODO:
@@ -330,7 +1502,16 @@ def _arg_parser():
     
     parser = argparse.ArgumentParser('usage: %prog FILENAME [options], or '
                                      '%prog -h to display help')
-    parser.add_argument('filename', help="The file to read")
+    parser.add_argument('filenames', nargs='+', metavar='filename', 
+                        help='The file(s) to read ("-" to read standard '
+                        'input). Directories and glob patterns are expanded.')
+    parser.add_argument('--approximate', type=_at_least(1), default=0, 
+                        metavar='COUNTERS',
+                        help='Count words in bounded memory, using COUNTERS '
+                        'counters, for very large texts. The unique word '
+                        'count and top word counts are then estimates, and '
+                        'word forms are folded by the stem table alone, so '
+                        'a top word may be a stem that is not in the text.')
     parser.add_argument('-a','--track-all-words', action='store_true', 
                       default=False, 
                       help='Run proximity check even for common words.')
@@ -342,45 +1523,159 @@ def _arg_parser():
                       'checking (overrides "-a").')
     parser.add_argument('-f','--file',dest='out_file',help='Write results to the '
                       'given file instead of to the screen.')
+    parser.add_argument('--cache-dir', metavar='DIR', 
+                        help='Keep the result cache in DIR (default: {}).'
+                        ''.format(prosl_cache.default_cache_dir()))
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        default=True, help='Neither use nor update the cache '
+                        'of results from earlier runs.')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='text',
+                        help='Write the results as a report (text), as JSON '
+                        'Lines (jsonl), or as CSV (csv). Default: %(default)s.')
+    parser.add_argument('--include', default='*.txt', metavar='PATTERN',
+                        help='Only read files matching PATTERN when searching '
+                        'directories (default: %(default)s).')
     parser.add_argument('-i','--indices', dest='indices', action='store_true',
                         default=False, help='Calculate various'
                         'readability scores for the text.')
+    parser.add_argument('-j','--jobs', type=int, default=None,
+                        help='Lint using up to JOBS worker processes. '
+                        'Multiple files are shared out between them (default: '
+                        'one per CPU); a single file is split into chunks '
+                        'only if JOBS is given.')
+    parser.add_argument('-m', '--max-flags', type=_at_least(0), default=0, 
+                        metavar='COUNT',
+                        help='Only report the first COUNT flags in the text. '
+                        'With -n, linting stops there.')
     parser.add_argument('-n','--nostats',dest='stats',action='store_false',
                       default=True,help='Turn off the general statistics.')
+    parser.add_argument('--profile', action='store_true', default=False,
+                        help='Time each phase of the run, and print a table '
+                        'of the timings to standard error.')
+    parser.add_argument('--profile-file', metavar='FILE',
+                        help='Run under cProfile, and save the profile to FILE '
+                        'for pstats.')
     parser.add_argument('-p','--prox', dest='proximity', type=int, default=0,
         help='Flag passages using the same word repeatedly (unless it is a '
         'common word in English). The argument is the minimum proximity for '
         'uncommon words.')
+    parser.add_argument('--sections', dest='section_pattern', 
+                        type=_section_pattern_arg, metavar='PATTERN',
+                        help='Also give the stats of each section, where '
+                        'sections start at lines matching PATTERN (a regular '
+                        'expression, such as "CHAPTER ").')
+    parser.add_argument('--section-gap', type=int, default=0, 
+                        metavar='LINES',
+                        help='Also start a section after each run of LINES '
+                        'or more blank lines.')
+    parser.add_argument('-t', '--top-words', type=int, default=TOP_WORDS,
+                        metavar='COUNT', help='List the COUNT commonest '
+                        'words (default: %(default)s).')
     parser.add_argument('-w', '--word-count', dest='word_thresh', type=int, 
         default=0, metavar='WORD_COUNT',
         help='Flag sentences with a word count of WORD_COUNT or more')
     return parser
 
+def _at_least(minimum):
+    '''Get an argument parser type for whole numbers of at least `minimum`.
+    '''
+
+    def whole_number(value):
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                                'not a whole number: {!r}'.format(value))
+        if number < minimum:
+            raise argparse.ArgumentTypeError(
+                                'must be at least {:d}'.format(minimum))
+        return number
+    return whole_number
+
+def _section_pattern_arg(pattern):
+    '''Check a --sections pattern for the argument parser.'''
+
+    try:
+        _compile_section_pattern(pattern)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return pattern
+
+def _phase(profiler, name):
+    '''profiler.phase(name), or a context that does nothing without one.'''
+
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
+
 def main():
     parser = _arg_parser()
-    filename = None
     try:
         if testing and len(sys.argv) < 2:
             sys.argv.extend(testing)
         opts = vars(parser.parse_args(sys.argv[1:]))
     except Exception as e:
-        print('Error parsing arguments: {!s}'.format(e))
-    try:
-        filename = os.path.abspath(opts['filename'])
-        with open(filename, 'r') as f:
-            filename = f.name
-            text = f.read()
-    except IOError as e:
-        print('Unable to read file "{}".'.format(filename))
-        parser.print_help()
-        return
-    
-    flags = analyze(text, **opts)
-    stats = (get_stats(text, opts.get('indices', False)) if opts.get('stats') 
-             else {})
-    write_results(flags, stats, **opts)
+        print('Error parsing arguments: {!s}'.format(e), file=sys.stderr)
+    paths = opts.pop('filenames')
+    profile, profile_file = opts.pop('profile'), opts.pop('profile_file')
+    profiler = None
+    if profile or profile_file:
+        import prosl_profile
+        profiler = prosl_profile.Profiler(profile_file)
+    with profiler or contextlib.nullcontext():
+        _run(parser, paths, profiler, opts)
+    if profile:
+        print(profiler.format_table(), file=sys.stderr)
+
+def _run(parser, paths, profiler, opts):
+    '''Do the work of main(), timing its phases if there is a `profiler`.'''
+
+    cache = None
+    if opts.pop('cache'):
+        try:
+            with _phase(profiler, 'open cache'):
+                cache = prosl_cache.ResultCache(opts.get('cache_dir'), 
+                                                version=CACHE_VERSION)
+        except IOError as e:
+            print('Not caching results: {!s}'.format(e), file=sys.stderr)
+    filenames = _expand_paths(paths, opts['include'])
+    if filenames != paths or len(filenames) > 1:
+        # Files are written out as they are linted, so these are one phase
+        with _phase(profiler, 'lint files') as phase:
+            summary = write_batch_results(lint_files(filenames, cache=cache,
+                                                     **opts), **opts)
+            if phase is not None:
+                phase.tokens = summary.get('Word Count', 0)
+    else:
+        filename = filenames[0]
+        try:
+            key = cached = None
+            if cache is not None and filename != '-':
+                with _phase(profiler, 'check cache'):
+                    key = cache.file_key(filename, opts)
+                    cached = cache.get(key)
+            if cached:
+                flags, stats = cached
+            elif (opts.get('jobs') or 1) > 1 and filename != '-':
+                # Split the one file up over the workers instead
+                with _phase(profiler, 'lint_file_parallel'):
+                    flags, stats = lint_file_parallel(filename, **opts)
+            else:
+                flags, stats = lint_file(filename, profiler, **opts)
+            if key and not cached:
+                with _phase(profiler, 'update cache'):
+                    cache.put(key, flags, stats)
+        except IOError as e:
+            print('Unable to read file "{}".'.format(
+                  filename if filename == '-' else os.path.abspath(filename)),
+                  file=sys.stderr)
+            parser.print_help(sys.stderr)
+            return
+        with _phase(profiler, 'output'):
+            write_results(flags, stats, **opts)
 
-    _count_syllables.cache.clear()
+    if cache is not None:
+        cache.close()
 
 testing = [r'./test/mobydick.txt','-e','-w','22','-c','100','-p','17','-i']
 
@@ -0,0 +1,148 @@
+'''asyncio entry points, for linting without blocking the event loop.
+
+Texts are cut between sentences into chunks, as for prosl.lint_parallel(),
+and the chunks are linted one after another in an executor. The event loop
+is free between chunks, so a cancelled lint stops within a chunk's time: no
+more of its chunks are started. Files are read in the loop's default
+(thread) executor.
+
+>>> linter = AsyncLinter(ProcessPoolExecutor(4), max_pending=8)
+>>> results = await asyncio.gather(*(linter.lint_file(name, proximity=10)
+...                                  for name in names))
+
+Pure-Python linting holds the GIL, so with the default executor (threads)
+the loop stays responsive but the work isn't any faster; give a
+ProcessPoolExecutor to really run documents in parallel.
+
+@author: Henry Keiter
+'''
+
+import asyncio
+import functools
+import os
+import prosl
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+def _read(filename):
+    with open(filename, 'r') as f:
+        return f.read()
+
+class AsyncLinter(object):
+    '''Lints texts in an `executor` (by default, the event loop's own).
+
+    At most `max_pending` texts (by default, one per CPU) are linted at a
+    time; the rest wait their turn without tying up the executor, which is
+    what keeps a flood of requests from swamping it. `chunk_size` is the
+    rough size of the pieces each text is linted in.
+    '''
+
+    def __init__(self, executor=None, max_pending=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self._pending = asyncio.Semaphore(max_pending or os.cpu_count() or 1)
+
+    async def lint(self, text, **opts):
+        '''Like prosl.lint().'''
+
+        async with self._pending:
+            return await self._lint(text, opts)
+
+    async def _lint(self, text, opts):
+        loop = asyncio.get_running_loop()
+        if prosl._sectioned(opts):
+            # Sections are linted in one go, by prosl.lint()
+            return await loop.run_in_executor(
+                    self.executor, functools.partial(prosl.lint, text, **opts))
+        proximity = prosl._proximity(opts)
+        merger = prosl._Merger(opts)
+        for start_line, start, end in prosl._chunk_text(text, self.chunk_size):
+            merger.add(*await loop.run_in_executor(
+                    self.executor, prosl._lint_chunk, text[start:end],
+                    start_line, prosl._window_before(text, start, proximity),
+                    opts))
+            if merger.done:
+                break # Nothing more to look for
+        flags, stats = merger.finish(len(text))
+        if stats is None:
+            return flags, {}
+        return flags, await loop.run_in_executor(
+                self.executor, stats.result, opts.get('indices', False),
+                opts.get('top_words'))
+
+    async def analyze(self, text, **opts):
+        '''Like prosl.analyze().'''
+
+        return (await self.lint(text, **dict(opts, stats=False)))[0]
+
+    async def get_stats(self, text, indices=False):
+        '''Like prosl.get_stats().'''
+
+        return (await self.lint(text, flags=False, indices=indices))[1]
+
+    async def lint_file(self, filename, **opts):
+        '''Like prosl.lint_file(), but for a named file only (not stdin).'''
+
+        async with self._pending:
+            text = await asyncio.get_running_loop().run_in_executor(
+                                                        None, _read, filename)
+            return await self._lint(text, opts)
+
+    async def lint_many(self, texts, **opts):
+        '''Lint all the `texts` concurrently. Returns their results in order.
+
+        If any fails, or this is cancelled, the rest are cancelled too.
+        '''
+
+        tasks = [asyncio.ensure_future(self.lint(text, **opts))
+                 for text in texts]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def lint_files(self, filenames, **opts):
+        '''Lint the files concurrently, like prosl.lint_files().
+
+        Returns a list of `(filename, flags, stats, error)`, in the order of
+        `filenames`; a file that couldn't be read or linted has its exception
+        as `error`, and None for `flags` and `stats`.
+        '''
+
+        async def job(filename):
+            try:
+                return (filename,) + await self.lint_file(filename,
+                                                          **opts) + (None,)
+            except (IOError, ValueError) as e:
+                return (filename, None, None, e)
+            except ZeroDivisionError:
+                return (filename, None, None, ValueError('Nothing to analyze'))
+
+        tasks = [asyncio.ensure_future(job(filename)) for filename in filenames]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+async def lint(text, executor=None, **opts):
+    '''Like prosl.lint(), run in `executor`.'''
+
+    return await AsyncLinter(executor).lint(text, **opts)
+
+async def analyze(text, executor=None, **opts):
+    '''Like prosl.analyze(), run in `executor`.'''
+
+    return await AsyncLinter(executor).analyze(text, **opts)
+
+async def get_stats(text, indices=False, executor=None):
+    '''Like prosl.get_stats(), run in `executor`.'''
+
+    return await AsyncLinter(executor).get_stats(text, indices)
+
+async def lint_file(filename, executor=None, **opts):
+    '''Like prosl.lint_file(), run in `executor`.'''
+
+    return await AsyncLinter(executor).lint_file(filename, **opts)
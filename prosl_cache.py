@@ -0,0 +1,167 @@
+'''Persistent cache of lint results, for texts that get linted again and again.
+
+Results are stored in a small SQLite database, keyed by a hash of the file's
+contents together with every option that affects the results and the version
+of prosl that produced them. Once the database grows past its size cap, the
+least recently used results are evicted.
+
+@author: Henry Keiter
+'''
+
+import hashlib
+import locale
+import marshal
+import os
+import sqlite3
+import time
+import zlib
+
+DEFAULT_MAX_SIZE = 256*1024*1024
+
+# Every option that changes the results, with its default in prosl.lint()
+RESULT_OPTIONS = (('proximity', 0), ('word_thresh', 17), ('char_thresh', 95),
+                  ('track_all_words', False), ('extended_list', False),
+                  ('stats', True), ('indices', False), ('max_flags', 0),
+                  ('top_words', 20), ('approximate', 0),
+                  ('section_pattern', ''), ('section_gap', 0))
+
+def default_cache_dir():
+    '''Get the per-user cache directory ($XDG_CACHE_HOME/prosl).'''
+
+    base = (os.environ.get('XDG_CACHE_HOME') or
+            os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'prosl')
+
+def _normalize(opts):
+    '''Get the options that affect lint results, in a fixed form.'''
+
+    normal = {}
+    for name, default in RESULT_OPTIONS:
+        # Anything falsy (such as None) is the type's own 0, '' or False
+        normal[name] = type(default)(opts.get(name, default) or 
+                                     type(default)())
+    # Some options only matter when others are on
+    if not normal['proximity']:
+        normal['track_all_words'] = normal['extended_list'] = False
+    if not normal['stats']:
+        normal['indices'] = False
+        normal['section_pattern'] = ''
+        normal['section_gap'] = 0
+    return repr(sorted(normal.items()))
+
+class ResultCache(object):
+    '''Size-capped, least-recently-used store of `(flags, stats)` results.
+
+    `version` should identify the code producing the results; results from
+    any other version are never returned. Safe to share between processes.
+    '''
+
+    _FORMAT = 1
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE, version=''):
+        cache_dir = cache_dir or default_cache_dir()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'results.sqlite')
+        self.max_size = max_size
+        self.version = version
+        try:
+            self._db = sqlite3.connect(self.path, timeout=30,
+                                       isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS results ('
+                             'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                             'size INTEGER NOT NULL, used REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_used '
+                             'ON results (used)')
+        except sqlite3.Error as e:
+            raise IOError('Unable to open cache at {}: {!s}'.format(self.path,
+                                                                     e))
+
+    def key(self, digest, opts):
+        '''Get the cache key for content with the given hash `digest`.'''
+
+        parts = [str(self._FORMAT), str(marshal.version), self.version,
+                 locale.getpreferredencoding(False), _normalize(opts), digest]
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def file_key(self, filename, opts):
+        '''Get the cache key for the named file's current contents.'''
+
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return self.key(digest.hexdigest(), opts)
+
+    def get(self, key):
+        '''Get the cached `(flags, stats)` for `key`, or None.
+
+        The cache is only an optimization, so a database that is locked or
+        broken just counts as a miss.
+        '''
+
+        try:
+            row = self._db.execute('SELECT value FROM results WHERE key = ?',
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE results SET used = ? WHERE key = ?',
+                             (time.time(), key))
+        except sqlite3.Error:
+            return None
+        try:
+            return marshal.loads(zlib.decompress(row[0]))
+        except (ValueError, EOFError, TypeError, zlib.error):
+            try:
+                self.discard(key)
+            except sqlite3.Error:
+                pass
+            return None
+
+    def put(self, key, flags, stats):
+        '''Store a result, evicting old ones if the cache is too big.
+
+        Like get(), this quietly does nothing if the database can't be used.
+        '''
+
+        value = zlib.compress(marshal.dumps((flags, stats)))
+        try:
+            self._db.execute('INSERT OR REPLACE INTO results '
+                             'VALUES (?, ?, ?, ?)',
+                             (key, value, len(value), time.time()))
+            self.evict()
+        except sqlite3.Error:
+            pass
+
+    def discard(self, key):
+        self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def evict(self, max_size=None):
+        '''Drop least recently used results until under `max_size` bytes.'''
+
+        max_size = self.max_size if max_size is None else max_size
+        total = self.size()
+        if total <= max_size:
+            return
+        rows = self._db.execute('SELECT key, size FROM results '
+                                'ORDER BY used, key').fetchall()
+        doomed = []
+        for key, size in rows:
+            if total <= max_size:
+                break
+            doomed.append((key,))
+            total -= size
+        self._db.executemany('DELETE FROM results WHERE key = ?', doomed)
+
+    def size(self):
+        return int(self._db.execute('SELECT TOTAL(size) FROM results'
+                                    ).fetchone()[0])
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def clear(self):
+        self._db.execute('DELETE FROM results')
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,12 @@
+'''Lint with the resident server (prosl_server.py), if one is running.
+
+Takes the same arguments as prosl.py, and writes the same output; only the
+linting is done by the server. Without a server, this just runs prosl.py.
+
+@author: Henry Keiter
+'''
+
+import prosl_server
+
+if __name__ == '__main__':
+    prosl_server.client_main()
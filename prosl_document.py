@@ -0,0 +1,295 @@
+'''Incremental linting of a document that is being edited.
+
+A Document keeps its text split into paragraphs, and caches each paragraph's
+flags and statistics. After an edit, only the paragraphs that the edit
+touched are linted again--plus any after them whose flags depend on the
+changed text, which is rarely more than one.
+
+>>> doc = Document(text, proximity=10, word_thresh=25)
+>>> doc.flags()
+[(10, 3, 'whale', '...'), ...]
+>>> doc.edit((3, 0), (3, 5), 'Whales')
+1
+>>> doc.stats()['Word Count']
+20418
+
+@author: Henry Keiter
+'''
+
+import bisect
+import copy
+import itertools
+import prosl
+
+def _split_paragraphs(lines):
+    '''Group lines into paragraphs: non-blank lines and the blank lines after.
+    '''
+
+    paragraph = []
+    for line in lines:
+        if paragraph and line.strip() and not paragraph[-1].strip():
+            yield paragraph
+            paragraph = []
+        paragraph.append(line)
+    if paragraph:
+        yield paragraph
+
+class _Paragraph(object):
+    '''Cached results for one paragraph.
+
+    `flags` are in document order, numbered from the paragraph's first line.
+    `state` is the `(window, sentence)` the paragraph was linted with: the 
+    tokens before it that its flags depend on. The paragraph's own tokens 
+    aren't kept, since they're only needed again if it is relinted; 
+    `tokens()` splits them anew.
+    '''
+
+    __slots__ = ('lines', 'chars', 'state', 'flags', 'stats')
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.chars = sum(map(len, lines)) + len(lines)
+        self.state = None
+        self.flags = []
+        self.stats = None
+
+    def tokens(self):
+        '''Get the paragraph's tokens, as from prosl._split_lines().'''
+
+        return list(prosl._split_lines(self.lines))
+
+class Document(object):
+    '''A text that can be edited and re-linted incrementally.
+
+    Takes the same options as prosl.lint(). `flags()` and `stats()` always
+    give the same results as prosl.lint() would for the current `text`;
+    `totals` are running counts that are kept up to date on every edit.
+    Paragraphs are linted without `max_flags`, which is applied to the 
+    whole document's flags instead. A Document isn't split into sections, so
+    `section_pattern` and `section_gap` raise ValueError.
+    '''
+
+    _EMPTY_STATE = ((), ())
+
+    def __init__(self, text='', **opts):
+        if opts.get('section_pattern') or opts.get('section_gap'):
+            raise ValueError('A Document is not split into sections; use '
+                             'prosl.lint() for section_pattern or '
+                             'section_gap')
+        self._max_flags = opts.pop('max_flags', None) or 0
+        self._opts = opts
+        self._proximity = opts.get('proximity', 0)
+        self._paragraphs = []
+        self._starts = None # First line of each paragraph; see _line_starts
+        self._flags = [] # Every paragraph's flags, numbered and sorted
+        self._stats = None
+        # The paragraphs' Stats, merged as they are linted. Its 
+        # `sentence_words` has all their words, until stats() takes out the
+        # ones after the last complete sentence. Sketches can't be taken 
+        # apart again, so approximate counts are merged afresh instead.
+        self._merged = (None if opts.get('approximate') or
+                        not opts.get('stats', True) else prosl.Stats())
+        self._totals = dict.fromkeys(('Flag Count', 'Character Count',
+                                      'Letter Count', 'Word Count',
+                                      'Sentence Count'), 0)
+        self._relint(0, 0, text.split('\n'))
+
+    @property
+    def text(self):
+        return '\n'.join(line for para in self._paragraphs
+                         for line in para.lines)
+
+    @property
+    def totals(self):
+        '''Counts of flags, characters, letters, words and sentences.'''
+
+        totals = dict(self._totals)
+        totals['Character Count'] -= 1 # No newline after the last line
+        if self._max_flags > 0:
+            totals['Flag Count'] = min(totals['Flag Count'], self._max_flags)
+        return totals
+
+    def set_text(self, text):
+        '''Replace the whole text.'''
+
+        return self._relint(0, len(self._paragraphs), text.split('\n'))
+
+    def edit(self, start, end, text):
+        '''Replace the text from `start` up to `end` with `text`, and re-lint.
+
+        `start` and `end` are `(line, column)` pairs. Lines are numbered from
+        1, as in flags, and columns from 0. Returns the number of paragraphs
+        that had to be linted again.
+        '''
+
+        starts = self._line_starts()
+        num_lines = starts[-1] + len(self._paragraphs[-1].lines) - 1
+        if not 1 <= start[0] <= end[0] <= num_lines:
+            raise IndexError('Edit out of range: {}-{}'.format(start, end))
+        first = bisect.bisect_right(starts, start[0]) - 1
+        last = bisect.bisect_right(starts, end[0]) - 1
+        lines = [line for para in self._paragraphs[first:last + 1]
+                 for line in para.lines]
+        sline, eline = start[0] - starts[first], end[0] - starts[first]
+        lines[sline:eline + 1] = (lines[sline][:start[1]] + text +
+                                  lines[eline][end[1]:]).split('\n')
+        if lines[-1].strip() and last + 1 < len(self._paragraphs):
+            # The blank line before the next paragraph is gone; join it.
+            last += 1
+            lines.extend(self._paragraphs[last].lines)
+        return self._relint(first, last + 1 - first, lines)
+
+    def flags(self):
+        '''Get all the flags, as from prosl.analyze().'''
+
+        if not self._max_flags:
+            return list(self._flags)
+        flags = []
+        for start, para in zip(self._line_starts(), self._paragraphs):
+            flags.extend((flag[0], flag[1] + start - 1) + flag[2:]
+                         for flag in para.flags)
+            if 0 < self._max_flags <= len(flags):
+                del flags[self._max_flags:]
+                break
+        flags.sort()
+        return flags
+
+    def stats(self):
+        '''Get the statistics, as from prosl.get_stats().
+
+        The counts are kept up to date on every edit, but the dict is only 
+        worked out from them again on the first call after one. Returns an 
+        empty dict if the `stats` option is off.
+        '''
+
+        if self._stats is None:
+            if not self._opts.get('stats', True):
+                self._stats = {}
+            else:
+                if self._merged is None:
+                    stats = prosl.Stats()
+                    for para in self._paragraphs:
+                        stats.merge(para.stats)
+                else:
+                    stats = copy.copy(self._merged)
+                    # Only words in complete sentences count toward their
+                    # length
+                    for para in reversed(self._paragraphs):
+                        stats.open_words += para.stats.open_words
+                        if para.stats.sentence_count:
+                            break
+                    stats.sentence_words -= stats.open_words
+                stats.char_count = self.totals['Character Count']
+                self._stats = stats.result(self._opts.get('indices', False),
+                                           self._opts.get('top_words'))
+        return self._stats
+
+    def _line_starts(self):
+        if self._starts is None:
+            self._starts = list(itertools.accumulate(
+                itertools.chain([1], (len(para.lines) for para in
+                                      self._paragraphs[:-1]))))
+        return self._starts
+
+    def _count(self, para, sign):
+        '''Add (sign=1) or remove (sign=-1) a paragraph's share of `totals`.'''
+
+        totals = self._totals
+        totals['Flag Count'] += sign*len(para.flags)
+        totals['Character Count'] += sign*para.chars
+        stats = para.stats
+        if stats is None:
+            return
+        totals['Letter Count'] += sign*stats.letter_count
+        totals['Word Count'] += sign*stats.word_count
+        totals['Sentence Count'] += sign*stats.sentence_count
+        merged = self._merged
+        if merged is not None:
+            merged.word_count += sign*stats.word_count
+            merged.token_length += sign*stats.token_length
+            merged.letter_count += sign*stats.letter_count
+            merged.sentence_count += sign*stats.sentence_count
+            merged.sentence_words += sign*(stats.sentence_words +
+                                           stats.open_words)
+            tally = merged.tally
+            for word, count in stats.tally.items():
+                count = tally.get(word, 0) + sign*count
+                if count:
+                    tally[word] = count
+                else:
+                    del tally[word]
+
+    def _next_state(self, para, tokens=None):
+        '''Get the state to lint the paragraph after `para` with.
+
+        `tokens` are the paragraph's tokens, if they're already at hand.
+        '''
+
+        return prosl._next_state((token for _, token in 
+                                  (tokens or para.tokens())), *para.state,
+                                 proximity=self._proximity)
+
+    def _relint(self, index, count, lines):
+        '''Replace `count` paragraphs from `index` on with `lines`, re-lint.
+
+        Linting carries on past the new paragraphs until it reaches one that
+        was already linted with the same state. Returns the number of
+        paragraphs linted.
+        '''
+
+        paragraphs = self._paragraphs
+        first_line = self._line_starts()[index] if paragraphs else 1
+        old_lines = 0
+        for para in paragraphs[index:index + count]:
+            self._count(para, -1)
+            old_lines += len(para.lines)
+        new = [_Paragraph(p) for p in _split_paragraphs(lines)]
+        new_lines = sum(len(para.lines) for para in new)
+        paragraphs[index:index + count] = new
+        self._starts = None
+        self._stats = None
+
+        state = (self._next_state(paragraphs[index - 1]) if index else
+                 self._EMPTY_STATE)
+        i = index
+        while i < len(paragraphs):
+            para = paragraphs[i]
+            if i >= index + len(new):
+                if para.state == state:
+                    break
+                self._count(para, -1)
+            tokens = para.tokens()
+            # Flags are kept in document order, for max_flags
+            para.flags, para.stats = prosl._collect(prosl._scan(
+                                                tokens, self._opts, *state))
+            para.state = state
+            self._count(para, 1)
+            state = self._next_state(para, tokens)
+            i += 1
+        self._patch_flags(index, i, first_line, new_lines - old_lines)
+        return i - index
+
+    def _patch_flags(self, index, end, first_line, shift):
+        '''Bring the sorted flags up to date after paragraphs were relinted.
+
+        Paragraphs `index` up to `end` were linted again, starting at 
+        `first_line`, and the lines after them have moved by `shift`.
+        '''
+
+        relinted = self._paragraphs[index:end]
+        old_end = first_line - shift + sum(len(para.lines)
+                                           for para in relinted)
+        flags = []
+        for flag in self._flags:
+            line = flag[1]
+            if line < first_line:
+                flags.append(flag)
+            elif line >= old_end:
+                flags.append((flag[0], line + shift) + flag[2:])
+        start = first_line
+        for para in relinted:
+            flags.extend((flag[0], flag[1] + start - 1) + flag[2:]
+                         for flag in para.flags)
+            start += len(para.lines)
+        flags.sort() # Two sorted runs, which sort() merges
+        self._flags = flags
@@ -0,0 +1,124 @@
+'''Timing of each phase of a lint, for finding out where a slow run went.
+
+>>> profiler = Profiler()
+>>> flags, stats = prosl.lint_file('mobydick.txt', profiler=profiler,
+...                                indices=True)
+>>> print(profiler.format_table())
+Phase               Wall (s)   CPU (s)   Tokens/s   Peak memory (MB)
+load dictionary        0.001     0.001                          24.9
+...
+
+Give a `pstats_file` and use the Profiler as a context manager to also run
+cProfile over everything inside the `with`, and save its statistics there
+for pstats (or snakeviz, etc.) to read.
+
+@author: Henry Keiter
+'''
+
+import contextlib
+import cProfile
+import sys
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError: # Not on Windows
+    resource = None
+
+def peak_memory():
+    '''Get the most memory the process has used so far, in bytes.
+
+    This is the peak resident set size, or None where that isn't available.
+    '''
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes; macOS, bytes
+    return peak if sys.platform == 'darwin' else peak*1024
+
+class Phase(object):
+    '''The measurements for one phase.
+
+    `wall` and `cpu` are in seconds. `tokens` is the number of tokens the
+    phase worked through (0 if it doesn't work on tokens). `peak_memory` is
+    in bytes: the most Python allocated during the phase if tracemalloc is
+    tracing, or else the process' peak memory use by the end of the phase.
+    '''
+
+    __slots__ = ('name', 'wall', 'cpu', 'tokens', 'peak_memory')
+
+    def __init__(self, name, tokens=0):
+        self.name = name
+        self.wall = self.cpu = 0.0
+        self.tokens = tokens
+        self.peak_memory = None
+
+    @property
+    def tokens_per_second(self):
+        return self.tokens/self.wall if self.tokens and self.wall else None
+
+class Profiler(object):
+    '''Records the time and memory taken by each phase of a run.
+
+    Code being profiled wraps each phase in `with profiler.phase(name)`;
+    the phases are kept in `phases`, in order.
+    '''
+
+    def __init__(self, pstats_file=None):
+        self.phases = []
+        self.pstats_file = pstats_file
+        self._cprofile = None
+
+    @contextlib.contextmanager
+    def phase(self, name, tokens=0):
+        '''Time the code in the `with` block as the phase `name`.
+
+        Yields the Phase, so that its `tokens` can be filled in once known.
+        '''
+
+        phase = Phase(name, tokens)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield phase
+        finally:
+            phase.wall = time.perf_counter() - wall
+            phase.cpu = time.process_time() - cpu
+            phase.peak_memory = (tracemalloc.get_traced_memory()[1] if tracing
+                                 else peak_memory())
+            self.phases.append(phase)
+
+    def __enter__(self):
+        if self.pstats_file:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.pstats_file)
+            self._cprofile = None
+
+    def format_table(self):
+        '''Format the phases, and their totals, as a table.'''
+
+        rows = ['{:<18}{:>10}{:>10}{:>11}{:>19}'.format(
+                    'Phase', 'Wall (s)', 'CPU (s)', 'Tokens/s',
+                    'Peak memory (MB)')]
+        def row(name, wall, cpu, rate, memory):
+            rows.append('{:<18}{:>10.3f}{:>10.3f}{:>11}{:>19}'.format(
+                name, wall, cpu, '' if rate is None else '{:.0f}'.format(rate),
+                '' if memory is None else '{:.1f}'.format(memory/2.0**20)))
+        for phase in self.phases:
+            row(phase.name, phase.wall, phase.cpu, phase.tokens_per_second,
+                phase.peak_memory)
+        memories = [p.peak_memory for p in self.phases
+                    if p.peak_memory is not None]
+        row('Total', sum(p.wall for p in self.phases),
+            sum(p.cpu for p in self.phases), None,
+            max(memories) if memories else None)
+        return '\n'.join(rows)
@@ -0,0 +1,364 @@
+'''A resident lint server, and the client for it.
+
+Every run of prosl.py starts an interpreter, imports prosl and--with -i--loads
+the syllable dictionary before it lints anything, which for a chapter or two
+is most of the run. The server pays for all of that once, and then lints
+whatever its clients send it:
+
+    $ python prosl_server.py &
+    $ python prosl_client.py chapter1.txt -p 10 -i
+
+prosl_client.py takes the same arguments as prosl.py and writes the same
+output, so scripts can just call it instead. When no server is running, the
+client lints the files itself.
+
+Each connection carries one JSON request and one JSON response. The server
+listens on a Unix socket that only its owner can use (see default_address()).
+It can listen on a localhost TCP port instead ("host:port"), but then any
+local user can have it read any file it can. It won't listen on any address
+but a loopback one.
+
+@author: Henry Keiter
+'''
+
+import argparse
+import concurrent.futures
+import ipaddress
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import prosl
+import prosl_cache
+
+# Options that only matter to the client, which writes the output
+CLIENT_OPTIONS = ('filenames', 'format', 'include', 'jobs', 'out_file',
+                  'profile', 'profile_file')
+# The most a request (which carries the text of standard input) may take up
+MAX_REQUEST_SIZE = 1 << 25
+
+class ServerUnavailable(OSError):
+    '''No server is listening at the address.'''
+
+def default_address():
+    '''Get the server's address: $PROSL_SERVER, or else a Unix socket.
+
+    The socket is in $XDG_RUNTIME_DIR if that is set, or else in the cache
+    directory.
+    '''
+
+    if os.environ.get('PROSL_SERVER'):
+        return os.environ['PROSL_SERVER']
+    base = os.environ.get('XDG_RUNTIME_DIR') or prosl_cache.default_cache_dir()
+    return os.path.join(base, 'prosl.sock')
+
+def _parse_address(address):
+    '''Turn "host:port" into a `(host, port)` pair; anything else is a path.'''
+
+    host, sep, port = address.rpartition(':')
+    if sep and host and port.isdigit():
+        return (host, int(port))
+    return address
+
+def _check_loopback(address):
+    '''Raise ValueError unless every address `host` names is a loopback one.
+    '''
+
+    host, port = address
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as e:
+        raise ValueError('Unknown host {!r}: {!s}'.format(host, e))
+    for info in infos:
+        # Drop the scope from IPv6 addresses like "fe80::1%eth0"
+        ip = ipaddress.ip_address(info[4][0].partition('%')[0])
+        if not ip.is_loopback:
+            raise ValueError('Refusing to listen on {} ({}): not a loopback '
+                             'address'.format(host, ip))
+
+def _request_options(options):
+    '''Check a request's options against prosl.py's, and fill in defaults.'''
+
+    defaults = vars(prosl._arg_parser().parse_args(['-']))
+    for name in CLIENT_OPTIONS:
+        defaults.pop(name, None)
+    unknown = set(options) - set(defaults)
+    if unknown:
+        raise ValueError('Unknown options: {}'.format(
+                         ', '.join(sorted(unknown))))
+    for name, value in options.items():
+        default = defaults[name]
+        if not (value is None or default is None or
+                isinstance(value, type(default))):
+            raise ValueError('Bad value for {}: {!r}'.format(name, value))
+    if options.get('section_pattern'):
+        prosl._compile_section_pattern(options['section_pattern'])
+    defaults.update(options)
+    return defaults
+
+def _encode_result(filename, flags, stats, error):
+    '''Make a lint_files() result into something json can write.'''
+
+    if error is not None:
+        return {'filename': filename, 'error': str(error),
+                'io_error': isinstance(error, IOError)}
+    return {'filename': filename, 'flags': flags, 
+            'stats': _encode_stats(stats)}
+
+def _encode_stats(stats):
+    stats = dict(stats)
+    if 'Syllable Distribution' in stats:
+        # Keys must be strings in JSON
+        stats['Syllable Distribution'] = list(
+                                        stats['Syllable Distribution'].items())
+    if 'Sections' in stats:
+        stats['Sections'] = [dict(section, Stats=_encode_stats(section['Stats']))
+                             for section in stats['Sections']]
+    return stats
+
+def _decode_result(result):
+    '''Undo _encode_result().'''
+
+    if 'error' in result:
+        error = (IOError if result['io_error'] else ValueError)(
+                                                            result['error'])
+        return (result['filename'], None, None, error)
+    return (result['filename'], list(map(tuple, result['flags'])),
+            _decode_stats(result['stats']), None)
+
+def _decode_stats(stats):
+    if 'Top Twenty Words' in stats:
+        stats['Top Twenty Words'] = list(map(tuple,
+                                             stats['Top Twenty Words']))
+    if 'Syllable Distribution' in stats:
+        stats['Syllable Distribution'] = dict(stats['Syllable Distribution'])
+    for section in stats.get('Sections', ()):
+        _decode_stats(section['Stats'])
+    return stats
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = self.rfile.read(MAX_REQUEST_SIZE + 1)
+            if len(request) > MAX_REQUEST_SIZE:
+                raise ValueError('larger than {:d} bytes'.format(
+                                 MAX_REQUEST_SIZE))
+            request = json.loads(request.decode('utf-8'))
+            response = {'results': self.server.lint(request)}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            response = {'error': 'Bad request: {!s}'.format(e)}
+        try:
+            self.wfile.write(json.dumps(response).encode('utf-8'))
+        except OSError:
+            pass # The client has gone away
+
+class _LintServer(socketserver.ThreadingMixIn):
+    '''Lints files for clients, each in its own thread.
+
+    With an `executor`, the linting itself is shared out to it, so that
+    clients can be served in parallel rather than taking turns in one
+    process.
+    '''
+
+    daemon_threads = True
+    executor = None
+
+    def lint(self, request):
+        '''Lint the files in a request. Returns the encoded results.
+
+        A request is a dict of `filenames` (relative to `cwd`), `options` as
+        from prosl.py's argument parser, and the text of standard input
+        (`stdin`) if one of the filenames is "-".
+        '''
+
+        opts = _request_options(request.get('options', {}))
+        names = request['filenames']
+        cwd = request.get('cwd', '')
+        cache = None
+        if opts.pop('cache'):
+            try:
+                cache = prosl_cache.ResultCache(
+                        opts.get('cache_dir'), version=prosl.CACHE_VERSION)
+            except IOError:
+                pass
+        try:
+            linted = prosl.lint_files(
+                    [os.path.join(cwd, name) for name in names if name != '-'],
+                    jobs=1, cache=cache, executor=self.executor, **opts)
+            results = []
+            for name in names:
+                if name == '-':
+                    result = prosl._lint_job(name, opts,
+                                             request.get('stdin') or '')
+                else:
+                    result = next(linted)
+                results.append(_encode_result(name, *result[1:]))
+            return results
+        finally:
+            if cache is not None:
+                cache.close()
+
+class UnixLintServer(_LintServer, socketserver.UnixStreamServer):
+    _bound = False
+
+    def server_bind(self):
+        path = self.server_address
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if os.path.exists(path):
+            try:
+                _connect(path).close()
+            except ServerUnavailable:
+                os.unlink(path) # Left behind by a server that is gone
+            else:
+                raise OSError('A server is already listening at ' + path)
+        umask = os.umask(0o177)
+        try:
+            socketserver.UnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        self._bound = True
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if self._bound:
+            try:
+                os.unlink(self.server_address)
+            except OSError:
+                pass
+
+class TCPLintServer(_LintServer, socketserver.TCPServer):
+    allow_reuse_address = True
+
+def make_server(address=None, jobs=1):
+    '''Set up a server at `address` (see default_address()), ready to serve.
+
+    The syllable dictionary and stem table are loaded up front. With `jobs` 
+    > 1, files are linted by a pool of that many worker processes. Raises 
+    ValueError for a TCP address that isn't a loopback one.
+    '''
+
+    address = _parse_address(address or default_address())
+    if isinstance(address, tuple):
+        _check_loopback(address)
+        server_class = TCPLintServer
+    else:
+        server_class = UnixLintServer
+    prosl.SYLLABLE_LOOKUP.load()
+    prosl.STEM_TABLE.load()
+    server = server_class(address, _Handler)
+    if jobs > 1:
+        server.executor = concurrent.futures.ProcessPoolExecutor(jobs)
+    return server
+
+def _connect(address):
+    '''Connect to the server, or raise ServerUnavailable.'''
+
+    try:
+        if isinstance(address, tuple):
+            return socket.create_connection(address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    except OSError as e:
+        raise ServerUnavailable('No server at {}: {!s}'.format(address, e))
+
+def request(filenames, options, address=None, stdin=None):
+    '''Have the server lint `filenames`, with prosl.py's `options`.
+
+    Returns a list of `(filename, flags, stats, error)`, as from
+    prosl.lint_files(). If "-" is one of the filenames, `stdin` is sent as
+    its text; if it isn't given, standard input is read (once the server
+    has answered the connection). Raises ServerUnavailable if there is no
+    server, and ValueError if the server couldn't make sense of the request
+    or it is larger than MAX_REQUEST_SIZE.
+    '''
+
+    sock = _connect(_parse_address(address or default_address()))
+    with sock:
+        if '-' in filenames and stdin is None:
+            stdin = sys.stdin.read()
+        data = json.dumps({'cwd': os.getcwd(),
+                           'filenames': list(filenames),
+                           'options': options,
+                           'stdin': stdin}).encode('utf-8')
+        if len(data) > MAX_REQUEST_SIZE:
+            raise ValueError('Request is larger than {:d} bytes'.format(
+                             MAX_REQUEST_SIZE))
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        response = b''.join(iter(lambda: sock.recv(1 << 16), b''))
+    response = json.loads(response.decode('utf-8'))
+    if 'error' in response:
+        raise ValueError(response['error'])
+    return [_decode_result(result) for result in response['results']]
+
+def client_main():
+    '''Run prosl.py's main(), but with the linting done by the server.'''
+
+    parser = prosl._arg_parser()
+    opts = vars(parser.parse_args(sys.argv[1:]))
+    if opts['profile'] or opts['profile_file']:
+        # That's for profiling prosl itself; there is no point in a server
+        return prosl.main()
+    paths = opts.pop('filenames')
+    filenames = prosl._expand_paths(paths, opts['include'])
+    try:
+        results = request(filenames, {name: value for name, value in
+                                      opts.items()
+                                      if name not in CLIENT_OPTIONS})
+    except ServerUnavailable:
+        return prosl.main()
+    if filenames != paths or len(filenames) > 1:
+        prosl.write_batch_results(results, **opts)
+        return
+    filename, flags, stats, error = results[0]
+    if isinstance(error, IOError):
+        print('Unable to read file "{}".'.format(
+              filename if filename == '-' else os.path.abspath(filename)),
+              file=sys.stderr)
+        parser.print_help(sys.stderr)
+        return
+    elif error is not None:
+        print('Unable to lint file "{}": {!s}'.format(filename, error),
+              file=sys.stderr)
+        return
+    prosl.write_results(flags, stats, **opts)
+
+def _arg_parser():
+    parser = argparse.ArgumentParser(description='Serve lint requests from '
+                                     'prosl_client.py.')
+    parser.add_argument('-a', '--address',
+                        help='Listen on this Unix socket, or on a loopback '
+                        '"host:port" (default: {}).'.format(default_address()))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Lint with a pool of JOBS worker processes '
+                        '(default: lint in the server process).')
+    return parser
+
+def main():
+    parser = _arg_parser()
+    opts = parser.parse_args()
+    try:
+        server = make_server(opts.address, opts.jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    # Shut down cleanly (removing the socket) when killed, too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+    print('Listening on {}'.format(server.server_address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if server.executor is not None:
+            server.executor.shutdown(cancel_futures=True)
+
+if __name__ == '__main__':
+    main()
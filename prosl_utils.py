@@ -4,20 +4,31 @@
 import bisect
 import collections
 import functools
+import hashlib
+import heapq
+import math
+import re
+import threading
+import time
+
+CacheInfo = collections.namedtuple('CacheInfo', 
+                                   'hits misses evictions maxsize currsize')
 
 class memoized(object):
     '''Decorator to memoize a function.
     
     Caches the function's return value when it is called; returns the cached
     value (rather than reevaluating) if the function is called later with the 
-    same arguments.
+    same arguments. Calls with unhashable arguments are just passed through.
     
     @WARNING: This should be used for costly, time-consuming operations, NOT 
     operations that are "slow" because they have to build a large return value.
-    Memoized functions are basically sanctioned memory leaks: memoizing 
-    thousands of large lists or other objects may result in memory errors! For
-    this reason, in any long-lived application, it is highly advised to clear
-    the cache when its work is done!
+    By default the cache is unbounded, which makes memoized functions 
+    sanctioned memory leaks: memoizing thousands of large lists or other 
+    objects may result in memory errors! In any long-lived application, give
+    a `maxsize` (the least recently used values are then evicted past that 
+    many) and/or a `ttl` (values expire that many seconds after they were 
+    computed), or clear the cache when its work is done.
     
     >>> @memoized
     >>> def test(x, y):
@@ -33,26 +44,100 @@ class memoized(object):
     >>> test.cache.clear()
     >>> test(10000, 10000) # Slow again
     [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, ...9999]
+    >>> test.cache_info()
+    CacheInfo(hits=1, misses=2, evictions=0, maxsize=None, currsize=1)
+    >>>
+    >>> @memoized(maxsize=1000, ttl=60)
+    >>> def lookup(word):
+    >>>     ...
+
+    The cache is safe to use from several threads, though two threads that
+    miss on the same arguments at once will both call the function.
     
     This is based on a memoizing recipe from the Python Decorator Library:
     http://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
     '''
 
-    def __init__(self, func):
+    def __init__(self, func=None, maxsize=None, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache = collections.OrderedDict()
+        self._expires = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.func = None
+        if func is not None:
+            self._wrap(func)
+
+    def _wrap(self, func):
         self.__name__ = func.__name__
         self.__doc__ = func.__doc__
         self.func = func
-        self.cache = {}
     
     def __call__(self, *args):
-        if not isinstance(args, collections.Hashable):
-            return self.func(*args)
-        if args in self.cache:
-            return self.cache[args]
-        else:
-            val = self.func(*args)
-            self.cache[args] = val
-            return val
+        if self.func is None:
+            # Used as @memoized(...); this call is the decoration.
+            self._wrap(*args)
+            return self
+        cache = self.cache
+        with self._lock:
+            try:
+                if args in cache:
+                    if (self.ttl is None or 
+                        self._expires.get(args, 0) > time.monotonic()):
+                        self.hits += 1
+                        if self.maxsize is not None:
+                            cache.move_to_end(args)
+                        return cache[args]
+                    del cache[args]
+                hashable = True
+            except TypeError:
+                hashable = False
+            self.misses += 1
+        val = self.func(*args)
+        if hashable:
+            with self._lock:
+                self._store(args, val)
+        return val
+
+    def _store(self, args, val):
+        if self.maxsize == 0:
+            return
+        cache = self.cache
+        cache[args] = val
+        if self.ttl is not None:
+            self._expires[args] = time.monotonic() + self.ttl
+        if self.maxsize is not None:
+            cache.move_to_end(args)
+            while len(cache) > self.maxsize:
+                self._expires.pop(cache.popitem(last=False)[0], None)
+                self.evictions += 1
+
+    def update(self, items):
+        '''Cache values computed elsewhere, from `(args, value)` pairs.
+
+        `args` is the tuple of arguments the value is for. Useful when many
+        values are cheaper to compute together than one call at a time.
+        '''
+
+        with self._lock:
+            for args, val in items:
+                self._store(args, val)
+
+    def cache_info(self):
+        '''Get the hit, miss and eviction counts and the cache size.'''
+
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, 
+                             self.maxsize, len(self.cache))
+
+    def cache_clear(self):
+        '''Empty the cache and reset its counters.'''
+
+        with self._lock:
+            self.cache.clear()
+            self._expires.clear()
+            self.hits = self.misses = self.evictions = 0
     
     def __repr__(self):
         return self.func.__doc__
@@ -60,6 +145,187 @@ class memoized(object):
     def __get__(self, obj, objtype):
         return functools.partial(self.__call__, obj)
 
+class LazyResource(object):
+    '''Proxy for a resource that should only be built when it is first used.
+
+    `loader` is called (once, even with several threads racing for it) the 
+    first time an attribute of the resource is needed; attribute access, 
+    `in`, `len()` and iteration are then forwarded to the loaded value.
+
+    >>> LOOKUP = LazyResource(expensive_dict_loader)
+    >>> LOOKUP.loaded
+    False
+    >>> LOOKUP.get('foo') # Slow: loads the dict
+    3
+    >>> LOOKUP.loaded
+    True
+    '''
+
+    _UNLOADED = object()
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._value = self._UNLOADED
+
+    @property
+    def loaded(self):
+        return self._value is not self._UNLOADED
+
+    def load(self):
+        '''Get the resource, loading it first if need be.'''
+
+        value = self._value
+        if value is self._UNLOADED:
+            with self._lock:
+                value = self._value
+                if value is self._UNLOADED:
+                    value = self._value = self._loader()
+        return value
+
+    def reset(self):
+        '''Drop the loaded resource; it will be reloaded on next use.'''
+
+        with self._lock:
+            self._value = self._UNLOADED
+
+    def __getattr__(self, name):
+        if name in ('_loader', '_lock', '_value'):
+            # Not initialized yet (e.g. mid-unpickle); don't recurse via load()
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __contains__(self, item):
+        return item in self.load()
+
+    def __len__(self):
+        return len(self.load())
+
+    def __iter__(self):
+        return iter(self.load())
+
+class SpaceSaving(object):
+    '''Approximate counts of the commonest items in a stream, in bounded memory.
+
+    This is Metwally et al.'s Space-Saving algorithm: only `capacity` items
+    are counted at a time, and a new item takes over the counter of the 
+    least counted one. Counts are never too low, and are at most `errors[item]`
+    too high; that is never more than `total/capacity`, so any item seen
+    more often than that is sure to be counted.
+
+    >>> counter = SpaceSaving(1000)
+    >>> for word in words:
+    ...     counter.add(word)
+    >>> counter.top(3)
+    [('the', 14620), ('of', 6732), ('and', 6430)]
+    '''
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError('SpaceSaving needs at least one counter')
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # One (count, item) per counted item; counts here may be stale (low)
+        self._heap = []
+
+    def add(self, item, count=1):
+        self.total += count
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self._heap, (count, item))
+        else:
+            low, victim = self._least()
+            del counts[victim], self.errors[victim]
+            counts[item] = low + count
+            self.errors[item] = low
+            heapq.heapreplace(self._heap, (low + count, item))
+
+    def _least(self):
+        '''Bring the least counted item to the top of the heap, and get it.'''
+
+        heap, counts = self._heap, self.counts
+        while heap[0][0] != counts[heap[0][1]]:
+            heapq.heapreplace(heap, (counts[heap[0][1]], heap[0][1]))
+        return heap[0]
+
+    def _floor(self):
+        '''Most times an item that isn't being counted could have been seen.'''
+
+        return self._least()[0] if len(self.counts) >= self.capacity else 0
+
+    def merge(self, other):
+        '''Add in the counts of another SpaceSaving.
+
+        Items counted in only one are taken to have been seen as often as 
+        they could have been in the other, so counts stay upper bounds.
+        '''
+
+        floor, other_floor = self._floor(), other._floor()
+        counts, errors = {}, {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = (self.counts.get(item, floor) + 
+                            other.counts.get(item, other_floor))
+            errors[item] = (self.errors.get(item, floor) + 
+                            other.errors.get(item, other_floor))
+        kept = heapq.nlargest(self.capacity, counts.items(), 
+                              key=lambda x:(x[1], x[0]))
+        self.counts = dict(kept)
+        self.errors = {item: errors[item] for item in self.counts}
+        self._heap = [(count, item) for item, count in kept]
+        heapq.heapify(self._heap)
+        self.total += other.total
+        return self
+
+    def top(self, n):
+        '''Get the `n` commonest items, as `(item, count)` pairs.'''
+
+        return heapq.nsmallest(n, self.counts.items(), 
+                               key=lambda x:(-x[1], x[0]))
+
+class HyperLogLog(object):
+    '''Approximate count of the distinct strings in a stream.
+
+    Uses `2**precision` bytes, and is usually within `1.04/sqrt(2**precision)`
+    of the true count (under 1% by default). Strings are hashed the same way
+    in every process, so counters from different processes can be merged.
+    '''
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        h = int.from_bytes(hashlib.blake2b(item.encode('utf-8', 
+                                                       'surrogatepass'),
+                                           digest_size=8).digest(), 'big')
+        bits = 64 - self.precision
+        index = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Can only merge HyperLogLogs of equal precision')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        estimate = (0.7213/(1 + 1.079/m)*m*m/
+                    sum(2.0**-r for r in self.registers))
+        empty = self.registers.count(0)
+        if estimate <= 2.5*m and empty:
+            # Small counts are better estimated from the empty registers
+            estimate = m*math.log(m/float(empty))
+        return int(round(estimate))
+
 def split_string(s, *delimiters, split_whitespace=True):
     '''Split a string by any number of delimiters.
 
@@ -80,6 +346,42 @@ def split_string(s, *delimiters, split_whitespace=True):
         splitlist = tmp
     return splitlist
 
+def compile_splitter(*delimiters):
+    '''Get a fast equivalent of `lambda s: split_string(s, *delimiters)`.
+
+    The whitespace split and all the delimiters are folded into one 
+    precompiled regex, so each string is split in a single pass. This only 
+    cuts in the same places as splitting by each delimiter in turn if the
+    delimiters don't overlap: none may contain whitespace or an earlier 
+    delimiter, or start with the end of another. ValueError otherwise.
+
+    >>> split = compile_splitter('--', '-')
+    >>> split('a-b c--d')
+    ['a', 'b', 'c', 'd']
+    '''
+
+    for i, d in enumerate(delimiters):
+        if not d or d != ''.join(d.split()):
+            raise ValueError('Bad delimiter: {!r}'.format(d))
+        for j, other in enumerate(delimiters):
+            if j > i and d in other:
+                raise ValueError('{!r} contains the earlier delimiter {!r}'
+                                 ''.format(other, d))
+            if j != i and any(d.endswith(other[:k]) for k in 
+                              range(1, min(len(d), len(other)))):
+                raise ValueError('{!r} overlaps {!r}'.format(d, other))
+    if not delimiters:
+        return str.split
+    escaped = list(map(re.escape, delimiters))
+    has_delimiter = re.compile('|'.join(escaped)).search
+    split = re.compile('|'.join([r'\s+'] + escaped)).split
+
+    def splitter(s):
+        if not has_delimiter(s):
+            return s.split()
+        return split(s.strip())
+    return splitter
+
 def search(key, items):
     '''Quick & dirty binary search using `bisect`. Find `key` in `items`.
 
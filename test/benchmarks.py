@@ -0,0 +1,297 @@
+'''Benchmarks for prosl.
+
+Run directly (python test/benchmarks.py). Every hot path is timed on
+synthetic prose at each requested size, and the timings are printed; give
+--json to also write them out in a form that later runs can be compared
+against with --compare:
+
+    python test/benchmarks.py --json before.json
+    ... (change things)
+    python test/benchmarks.py --compare before.json
+
+Nothing here needs a network connection. The 100MB size is left out unless
+--huge is given, since it takes several minutes.
+'''
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import timeit
+parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parentdir)
+import _resources
+import prosl
+import prosl_utils
+from tests import lorem_ipsum
+
+SIZES = (('10KB', 10*1024), ('1MB', 1024*1024))
+HUGE_SIZES = (('100MB', 100*1024*1024),)
+PROXIMITIES = (10, 50, 200)
+
+def synthetic_text(size, seed=0):
+    '''Get about `size` characters of prose, always the same for a `seed`.
+
+    The text opens with the lorem_ipsum sentence, and goes on with sentences
+    of its words, in paragraphs of wrapped lines like those of a manuscript.
+    Sentence lengths vary enough to trip the word- and character-count
+    thresholds now and then.
+    '''
+
+    rng = random.Random(seed)
+    words = lorem_ipsum.split()
+    out = io.StringIO()
+    paragraph = [lorem_ipsum]
+    written = 0
+    while written < size:
+        for _ in range(rng.randint(2, 8)):
+            sentence = rng.choices(words, k=rng.randint(3, 30))
+            sentence[0] = sentence[0].capitalize()
+            paragraph.append(' '.join(sentence).rstrip(',;.') +
+                             rng.choice('....?!'))
+        lines = []
+        line = []
+        width = 0
+        for word in ' '.join(paragraph).split():
+            if line and width + len(word) > 72:
+                lines.append(' '.join(line))
+                line = []
+                width = 0
+            line.append(word)
+            width += len(word) + 1
+        lines.append(' '.join(line))
+        chunk = '\n'.join(lines) + '\n\n'
+        out.write(chunk)
+        written += len(chunk)
+        paragraph = []
+    return out.getvalue()[:size]
+
+def _best(func, repeat, setup=None):
+    '''Best wall time of `repeat` calls of `func`, calling `setup` first.'''
+
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _time_subprocess(code, repeat):
+    '''Best wall time of `repeat` fresh interpreters running `code`.'''
+
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code], cwd=parentdir)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_import(repeat=5):
+    '''Time `import prosl` against a bare interpreter start.
+
+    The syllable dictionary is loaded lazily, so importing prosl should cost
+    next to nothing over interpreter startup. Returns the timings in seconds.
+    '''
+
+    bare = _time_subprocess('pass', repeat)
+    imported = _time_subprocess('import prosl', repeat)
+    loaded = _time_subprocess('import prosl; prosl.SYLLABLE_LOOKUP.load()',
+                              repeat)
+    return {'interpreter': bare,
+            'import prosl': imported - bare,
+            'import prosl + syllable dictionary': loaded - bare}
+
+def bench_syllable_dict(repeat=5):
+    '''Time building the syllable dictionary from its source.'''
+
+    return {'get_syllable_dict': _best(_resources.get_syllable_dict, repeat)}
+
+def bench_syllable_lookup(repeat=5, count=10000):
+    '''Time `count` lookups in the compiled syllable dictionary.
+
+    Compares the memory-mapped SyllableLookup that prosl uses with a plain
+    dict of the same words (which costs over 20MB per process, where the
+    mapped file is under 3MB and shared). Returns the best time for each, in
+    seconds.
+    '''
+
+    words = _resources.get_syllable_dict()
+    lookup = _resources.load_syllable_lookup()
+    sample = random.Random(0).sample(sorted(words), count)
+    def lookups(mapping):
+        get = mapping.get
+        for word in sample:
+            get(word)
+    return {'dict lookup': _best(lambda: lookups(words), repeat),
+            'SyllableLookup lookup': _best(lambda: lookups(lookup), repeat)}
+
+def bench_split(repeat=5):
+    '''Time splitting every line of Moby Dick into tokens.
+
+    Compares split_string() with the precompiled splitter prosl uses.
+    Returns the best time for each, in seconds.
+    '''
+
+    with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+        lines = f.read().split('\n')
+    delimiters = _resources.NWS_DELIMITERS
+    splitter = prosl_utils.compile_splitter(*delimiters)
+    def old():
+        for line in lines:
+            prosl_utils.split_string(line, *delimiters)
+    def new():
+        for line in lines:
+            splitter(line)
+    return {'split_string': min(timeit.repeat(old, number=1, repeat=repeat)),
+            'compile_splitter': min(timeit.repeat(new, number=1,
+                                                  repeat=repeat))}
+
+def bench_text(text, repeat=3):
+    '''Time each stage of linting `text`.
+
+    Returns the best time for each, in seconds, keyed by `(name, params)`.
+    Syllable counts are cleared before each run of get_stats(), so those
+    times include counting every word afresh.
+    '''
+
+    prosl.SYLLABLE_LOOKUP.load()
+    prosl.STEM_TABLE.load()
+    lines = text.split('\n')
+    delimiters = _resources.NWS_DELIMITERS
+    clear = prosl._count_syllables.cache_clear
+    def split_all():
+        for line in lines:
+            prosl_utils.split_string(line, *delimiters)
+    results = {
+        ('_split_text', ()): _best(lambda: list(prosl._split_text(text)),
+                                   repeat),
+        ('split_string', ()): _best(split_all, repeat),
+        ('get_stats', (('indices', False),)): _best(
+                        lambda: prosl.get_stats(text), repeat, clear),
+        ('get_stats', (('indices', True),)): _best(
+                        lambda: prosl.get_stats(text, True), repeat, clear),
+        }
+    for proximity in PROXIMITIES:
+        results['analyze', (('proximity', proximity),)] = _best(
+                        lambda: prosl.analyze(text, proximity=proximity),
+                        repeat)
+    opts = {'proximity': PROXIMITIES[0], 'indices': True,
+            'out_file': os.devnull}
+    flags = prosl.analyze(text, **opts)
+    stats = prosl.get_stats(text, True)
+    results['write_results', ()] = _best(
+                        lambda: prosl.write_results(flags, stats, **opts),
+                        repeat)
+    return results
+
+def run(sizes=SIZES, repeat=3):
+    '''Run every benchmark. Returns a list of result dicts.
+
+    Each result has the benchmark's name, its params, the text size it ran
+    on (or None), the best time in seconds and, for sized runs, the
+    throughput in MB/s.
+    '''
+
+    results = []
+    for bench in (bench_import, bench_syllable_dict, bench_syllable_lookup,
+                  bench_split):
+        for name, seconds in bench(repeat).items():
+            results.append({'benchmark': name, 'params': {}, 'size': None,
+                            'seconds': seconds})
+    for label, size in sizes:
+        text = synthetic_text(size)
+        for (name, params), seconds in sorted(bench_text(text,
+                                                         repeat).items()):
+            results.append({'benchmark': name, 'params': dict(params),
+                            'size': label, 'seconds': seconds,
+                            'mb_per_s': size/(1024*1024)/seconds})
+    return results
+
+def _key(result):
+    return (result['benchmark'], result['size'] or '',
+            json.dumps(result['params'], sort_keys=True))
+
+def _name(result):
+    params = ', '.join('{}={}'.format(*item)
+                       for item in sorted(result['params'].items()))
+    name = result['benchmark'] + ('({})'.format(params) if params else '')
+    if result['size']:
+        name += ' @' + result['size']
+    return name
+
+def compare(old, new, tolerance):
+    '''Get `(result, old seconds)` for each of `new` that got slower.
+
+    A result counts as slower if it took more than `1 + tolerance` times its
+    old time. Results that weren't run before are skipped.
+    '''
+
+    old = {_key(result): result['seconds'] for result in old}
+    return [(result, old[_key(result)]) for result in new
+            if _key(result) in old and
+               result['seconds'] > old[_key(result)]*(1 + tolerance)]
+
+def _arg_parser():
+    parser = argparse.ArgumentParser(description='Time prosl\'s hot paths.')
+    parser.add_argument('--huge', action='store_true',
+                        help='Also time 100MB of text.')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Take the best of this many runs (default 3).')
+    parser.add_argument('--json', metavar='FILE',
+                        help='Write the results to FILE as JSON (- for '
+                             'stdout).')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare against results from an earlier --json '
+                             'run, and exit with status 1 on a regression.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='How much slower counts as a regression, as a '
+                             'fraction (default 0.25).')
+    return parser
+
+def main(argv=None):
+    args = _arg_parser().parse_args(argv)
+    sizes = SIZES + HUGE_SIZES if args.huge else SIZES
+    results = run(sizes, args.repeat)
+    report = sys.stderr if args.json == '-' else sys.stdout
+    for result in results:
+        print('{:<48}{:>12.2f} ms'.format(_name(result),
+                                          result['seconds']*1000),
+              file=report)
+    if args.json:
+        document = {'format': 1,
+                    'prosl_version': prosl.__version__,
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                               time.gmtime()),
+                    'repeat': args.repeat,
+                    'results': results}
+        if args.json == '-':
+            json.dump(document, sys.stdout, indent=1)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(document, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)['results']
+        slower = compare(old, results, args.tolerance)
+        for result, seconds in slower:
+            print('Slower: {} ({:.2f} ms -> {:.2f} ms)'.format(
+                    _name(result), seconds*1000, result['seconds']*1000),
+                  file=report)
+        if slower:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,17 @@
 '''Unit testing module for prosl'''
 
+import argparse
 import sys
 import os
 import unittest
 parentdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parentdir)
 import prosl
+import prosl_async
+import prosl_cache
+import prosl_document
+import prosl_profile
+import prosl_server
 import prosl_utils
 import _resources
 
@@ -94,6 +100,26 @@ class TestAnalytics(unittest.TestCase):
         self.assertEqual(2, prosl._estimate_syllables('faced'))
         self.assertEqual(2, prosl._estimate_syllables('james'))
 
+    def test_estimate_syllables_batch(self):
+        words = ['', 'a', 'an', 'I', 'the', 'ate', 'oat', 'nn', 'tree', 'fire',
+                 'pale', 'gross', 'strengths', 'archaeopterix', 'pterodactyl',
+                 'hound', 'hounded', 'vacuum', 'continuum', 'superfluous',
+                 'apple', 'faced', 'james', 'QUEUEING', 'EYE', 'aaaaa']
+        self.assertEqual([prosl._estimate_syllables(w) for w in words],
+                         prosl._estimate_syllables_batch(words))
+        # Enough words to be estimated together
+        words *= prosl._BATCH_ESTIMATE_MIN // len(words) + 1
+        self.assertEqual([prosl._estimate_syllables(w) for w in words],
+                         prosl._estimate_syllables_batch(words))
+        self.assertEqual([], prosl._estimate_syllables_batch([]))
+
+        prosl._count_syllables.cache_clear()
+        self.assertEqual([1, 3, 1], prosl._count_syllables_batch(
+                                           ['whale', 'zorbleflux', 'whale']))
+        self.assertEqual(2, prosl._count_syllables.cache_info().currsize)
+        self.assertEqual(3, prosl._count_syllables('zorbleflux'))
+        self.assertEqual(1, prosl._count_syllables.cache_info().hits)
+
     def test_count_syllables(self):
         self.assertEqual(0, prosl._count_syllables(''))
 
@@ -254,6 +280,263 @@ class TestCore(unittest.TestCase):
         self.assertEqual(1, len(flags))
         self.assertEqual(prosl.CTHRESH_FLAG, flags[0][0])
 
+    def test_lint(self):
+        opts = dict(proximity=15, word_thresh=20, char_thresh=100)
+        flags, stats = prosl.lint(lorem_ipsum, **opts)
+        self.assertEqual(prosl.analyze(lorem_ipsum, **opts), flags)
+        self.assertEqual(prosl.get_stats(lorem_ipsum), stats)
+        self.assertEqual(8, len(flags))
+
+        flags, stats = prosl.lint(lorem_ipsum, stats=False, **opts)
+        self.assertEqual(prosl.analyze(lorem_ipsum, **opts), flags)
+        self.assertEqual({}, stats)
+
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            text = f.read()
+        opts = dict(proximity=17, word_thresh=22, char_thresh=100, 
+                    extended_list=True, indices=True)
+        flags, stats = prosl.lint(text, **opts)
+        self.assertEqual(prosl.analyze(text, **opts), flags)
+        self.assertEqual(prosl.get_stats(text, indices=True), stats)
+
+    def test_lint_lines(self):
+        import io
+        opts = dict(proximity=15, word_thresh=20, char_thresh=100)
+        self.assertEqual(prosl.lint(lorem_ipsum, **opts),
+                         prosl.lint_lines(io.StringIO(lorem_ipsum), **opts))
+
+        # Sentences and proximity windows carry over line breaks.
+        text = lorem_ipsum.replace('; ', ';\n').replace(', ', ',\r\n')
+        with io.StringIO(text, newline=None) as f:
+            flags, stats = prosl.lint_lines(f, **opts)
+        self.assertEqual(prosl.lint(text.replace('\r\n', '\n'), **opts),
+                         (flags, stats))
+        self.assertEqual(1, stats['Sentence Count'])
+        self.assertEqual(475, stats['Word Count'])
+
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            text = f.read()
+            f.seek(0)
+            self.assertEqual(prosl.lint(text, **opts),
+                             prosl.lint_lines(f, **opts))
+
+    def test_lint_files(self):
+        import tempfile
+        opts = dict(proximity=15, word_thresh=20, char_thresh=100)
+        with tempfile.TemporaryDirectory() as tmp:
+            names = []
+            for i in range(3):
+                names.append(os.path.join(tmp, '{}.txt'.format(i)))
+                with open(names[-1], 'w') as f:
+                    f.write(' '.join([lorem_ipsum]*(i + 1)))
+            os.mkdir(os.path.join(tmp, 'sub'))
+            with open(os.path.join(tmp, 'sub', 'a.txt'), 'w') as f:
+                f.write(lorem_ipsum)
+            with open(os.path.join(tmp, 'sub', 'b.md'), 'w') as f:
+                f.write(lorem_ipsum)
+
+            self.assertEqual(names + [os.path.join(tmp, 'sub', 'a.txt')],
+                             prosl._expand_paths([tmp]))
+            self.assertEqual(names, 
+                             prosl._expand_paths([os.path.join(tmp, '*.txt')]))
+            self.assertEqual([os.path.join(tmp, 'sub', 'b.md'), 'nope'],
+                             prosl._expand_paths([tmp, 'nope'], '*.md'))
+
+            missing = os.path.join(tmp, 'missing.txt')
+            empty = os.path.join(tmp, 'empty.txt')
+            open(empty, 'w').close()
+            for jobs in (1, 2):
+                results = list(prosl.lint_files(names + [missing, empty], 
+                                                jobs=jobs, **opts))
+                self.assertEqual(names + [missing, empty], 
+                                 [r[0] for r in results])
+                for name, flags, stats, error in results[:-2]:
+                    with open(name) as f:
+                        self.assertEqual(prosl.lint(f.read(), **opts), 
+                                         (flags, stats))
+                    self.assertIsNone(error)
+                self.assertEqual((None, None), results[-2][1:3])
+                self.assertIsInstance(results[-2][3], IOError)
+                self.assertEqual((None, None), results[-1][1:3])
+                self.assertIsInstance(results[-1][3], ValueError)
+
+    def test_stats_merge(self):
+        # Inflected forms fold into their stems, wherever they occur
+        text = 'box boxes boxes boxe boxes. Cats cat cats. Fishing fish.'
+        stats = prosl.get_stats(text)
+        self.assertEqual([('box', 4), ('cat', 3), ('fish', 2), ('boxe', 1)],
+                         stats['Top Twenty Words'])
+        self.assertEqual(stats['Top Twenty Words'], prosl.get_stats(
+                    ' '.join(reversed(text.split())))['Top Twenty Words'])
+
+        words = text.split()
+        for cut in range(1, len(words)):
+            head = prosl._process(prosl._split_text(' '.join(words[:cut])),
+                                  {'flags':False})[1]
+            tail = prosl._process(prosl._split_text(' '.join(words[cut:])),
+                                  {'flags':False})[1]
+            merged = head.merge(tail)
+            merged.char_count = len(text)
+            self.assertEqual(stats, merged.result())
+
+    def test_stem(self):
+        self.assertEqual('horse', prosl._stem('horses'))
+        self.assertEqual('wicked', prosl._stem('wicked'))
+        self.assertEqual('wish', prosl._stem('wished')) # Not in the dictionary
+        self.assertEqual('whale', prosl._stem("whale's"))
+        self.assertEqual('queequeg', prosl._stem("queequeg's"))
+        self.assertEqual('walk', prosl._stem('walking'))
+        self.assertEqual('his', prosl._stem('his'))
+        self.assertEqual('bed', prosl._stem('bed'))
+        # Not inflections at all
+        for word in ('indeed', 'does', 'need', 'speed'):
+            self.assertEqual(word, prosl._stem(word))
+        for word, stem in (('needed', 'need'), ('coming', 'come'), 
+                           ('gazing', 'gaze'), ('hoping', 'hope'), 
+                           ('putting', 'put'), ('stopped', 'stop'), 
+                           ('pointed', 'point'), ('formed', 'form'),
+                           ('carried', 'carry'), ('calling', 'call')):
+            self.assertEqual(stem, prosl._stem(word))
+        # A stem only counts if it is in the text ("dure" is in the 
+        # dictionary, but isn't what "during" is)
+        top = dict(prosl.get_stats('During those days. Come, coming.')[
+                                                        'Top Twenty Words'])
+        self.assertEqual({'during': 1, 'those': 1, 'days': 1, 'come': 2}, top)
+
+    def test_lint_parallel(self):
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            text = f.read()[:100000]
+        for opts in [dict(proximity=17, word_thresh=22, char_thresh=100),
+                     dict(proximity=200, track_all_words=True, stats=False)]:
+            expected = prosl.lint(text, **opts)
+            for chunk_size in (100, 10000):
+                self.assertEqual(expected, prosl.lint_parallel(
+                                 text, jobs=2, chunk_size=chunk_size, **opts))
+
+        chunks = list(prosl._chunk_text(text, 10000))
+        self.assertEqual(0, chunks[0][1])
+        self.assertEqual(len(text), chunks[-1][2])
+        for (line, start, end), (next_line, next_start, _) in zip(chunks, 
+                                                                  chunks[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(line + text.count('\n', start, end), next_line)
+            self.assertTrue(prosl._ends_sentence(text[:end].split()[-1]))
+
+    def test_lint_file_parallel(self):
+        import tempfile
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            text = f.read()[:100000]
+        opts = dict(proximity=17, word_thresh=22, char_thresh=100)
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, newline in (('unix.txt', '\n'), ('dos.txt', '\r\n')):
+                path = os.path.join(tmp, name)
+                with open(path, 'w', newline=newline) as f:
+                    f.write(text)
+                expected = prosl.lint_file(path, **opts)
+                for chunk_size in (100, 10000):
+                    self.assertEqual(expected, prosl.lint_file_parallel(
+                                     path, jobs=2, chunk_size=chunk_size, 
+                                     **opts))
+            path = os.path.join(tmp, 'empty.txt')
+            open(path, 'w').close()
+            self.assertEqual(([], {}), prosl.lint_file_parallel(path, jobs=2,
+                                                                stats=False))
+
+    def test_lint_sections(self):
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            text = f.read()[:100000]
+        opts = dict(proximity=17, word_thresh=22, char_thresh=100,
+                    indices=True)
+        flags, stats = prosl.lint(text, **opts)
+        for sections in (dict(section_pattern=r'CHAPTER \d'),
+                         dict(section_gap=3)):
+            sectioned = prosl.lint(text, **dict(opts, **sections))
+            self.assertEqual(flags, sectioned[0])
+            by_section = sectioned[1].pop('Sections')
+            self.assertEqual(stats, sectioned[1])
+        by_section = prosl.lint(text, section_pattern=r'CHAPTER \d')[1][
+                                                                'Sections']
+        self.assertEqual(['The Project Gutenberg EBook of Moby Dick; or The '
+                          'Whale, by Herman Melville', 'CHAPTER 1. Loomings.',
+                          'CHAPTER 2. The Carpet-Bag.'],
+                         [section['Title'] for section in by_section[:3]])
+        self.assertEqual(len(text), sum(section['Stats']['Character Count']
+                                        for section in by_section))
+        self.assertEqual(stats['Word Count'], sum(
+            section['Stats']['Word Count'] for section in by_section))
+        # Each section's stats are those of its text alone
+        text = ('One two three. Four five.\n\n\nSix seven eight nine ten.\n'
+                'Eleven twelve\n\n\n\nthirteen. No\n\n\nend')
+        sections = prosl.lint(text, section_gap=2)[1]['Sections']
+        self.assertEqual([('One two three. Four five.', 1),
+                          ('Six seven eight nine ten.', 4), 
+                          ('thirteen. No', 9), ('end', 12)],
+                         [(s['Title'], s['Line']) for s in sections])
+        self.assertEqual(prosl.get_stats(text[:text.index('Six')]),
+                         sections[0]['Stats'])
+        self.assertEqual(1, sections[1]['Stats']['Sentence Count'])
+        # Only the sentence's words in the section count towards its length
+        self.assertEqual(1.0, sections[2]['Stats']['Average Sentence Length'])
+        self.assertEqual({}, sections[3]['Stats']) # No sentence ends there
+        self.assertRaises(ValueError, prosl.lint, text, section_pattern='(')
+        error = list(prosl.lint_files([os.path.join(parentdir, 'test', 
+                                                    '1.txt')], 
+                                      jobs=1, section_pattern='('))[0][3]
+        self.assertIsInstance(error, ValueError)
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            self.assertEqual(prosl.lint(f.read(), section_gap=4),
+                             prosl.lint_file(os.path.join(
+                                parentdir, 'test', 'mobydick.txt'),
+                                section_gap=4))
+
+    def test_lazy_syllable_lookup(self):
+        import subprocess
+        code = ('import prosl\n'
+                'assert not prosl.SYLLABLE_LOOKUP.loaded\n'
+                'prosl.analyze(open("test/mobydick.txt").read(), proximity=5)\n'
+                'prosl.get_stats("Call me Ishmael.")\n'
+                'assert not prosl.SYLLABLE_LOOKUP.loaded\n'
+                'assert prosl.SYLLABLE_LOOKUP.get("aa") == 2\n'
+                'assert prosl.SYLLABLE_LOOKUP.loaded\n')
+        subprocess.check_call([sys.executable, '-c', code], cwd=parentdir)
+
+    def test_analyze_proximity(self):
+        tokens = [t for _, t in prosl._split_text(lorem_ipsum)]
+        simple = [t.strip(_resources.PUNCTUATION).lower() for t in tokens]
+        for proximity in (1, 2, 15, 100, 1000):
+            expected = [(prosl.PROXIMITY_FLAG, 1, word, 
+                         ' '.join(tokens[max(0, i - proximity):i + 1]))
+                        for i, word in enumerate(simple) 
+                        if word not in _resources.COMMON_WORDS and
+                        word in simple[max(0, i - proximity):i]]
+            self.assertEqual(sorted(expected), 
+                             prosl.analyze(lorem_ipsum, proximity=proximity,
+                                           word_thresh=0, char_thresh=0))
+
+    def test_analyze_iter(self):
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            text = f.read()
+        opts = dict(proximity=17, word_thresh=22, char_thresh=100)
+        flags = prosl.analyze(text, **opts)
+        in_order = list(prosl.analyze_iter(text, **opts))
+        self.assertEqual(flags, sorted(in_order))
+        self.assertEqual(sorted(in_order, key=lambda flag: flag[1]), in_order)
+        self.assertEqual(flags, list(prosl.analyze_iter(text, len(flags), 
+                                                        **opts)))
+        self.assertEqual(flags, sorted(prosl.analyze_iter(text, 10, **opts)))
+
+        # max_flags keeps the first flags in the text
+        self.assertEqual(sorted(in_order[:5]), 
+                         prosl.analyze(text, max_flags=5, **opts))
+        self.assertEqual(in_order[:5], 
+                         list(prosl.analyze_iter(text, max_flags=5, **opts)))
+        limited = prosl.lint(text, max_flags=5, **opts)
+        self.assertEqual(sorted(in_order[:5]), limited[0])
+        self.assertEqual(prosl.get_stats(text), limited[1])
+        self.assertEqual(limited, prosl.lint_parallel(text, jobs=2, 
+                                                      chunk_size=100000,
+                                                      max_flags=5, **opts))
+
     def test_get_stats(self):
         stats = prosl.get_stats(lorem_ipsum)
         
@@ -264,14 +547,14 @@ class TestCore(unittest.TestCase):
         self.assertEqual(475, stats.get('Average Sentence Length'))
         self.assertAlmostEqual(4.827368421052632, 
                                stats.get('Average Word Length'))
-        self.assertEqual(252, stats.get('Unique Words'))
+        self.assertEqual(251, stats.get('Unique Words'))
         self.assertEqual([('the',56),('of',30),('and',21),('in',17),
                           ('white',16),('though',12),('to',7),('a',5),
                           ('this',5),('all',4),('for',4),('great',4),
                           ('hue',4),('made',4),('their',4),('among',3),
                           ('being',3),('by',3),('even',3),('is',3)], 
                          stats.get('Top Twenty Words'))
-        self.assertAlmostEqual(53.05263157894737, stats.get('Lexical Density'))
+        self.assertAlmostEqual(52.84210526315789, stats.get('Lexical Density'))
 
         # With indices
         stats = prosl.get_stats(lorem_ipsum, indices=True)
@@ -286,14 +569,134 @@ class TestCore(unittest.TestCase):
         self.assertEqual(475, stats.get('Average Sentence Length'))
         self.assertAlmostEqual(4.827368421052632, 
                                stats.get('Average Word Length'))
-        self.assertEqual(252, stats.get('Unique Words'))
+        self.assertEqual(251, stats.get('Unique Words'))
         self.assertEqual([('the',56),('of',30),('and',21),('in',17),
                           ('white',16),('though',12),('to',7),('a',5),
                           ('this',5),('all',4),('for',4),('great',4),
                           ('hue',4),('made',4),('their',4),('among',3),
                           ('being',3),('by',3),('even',3),('is',3)], 
                          stats.get('Top Twenty Words'))
-        self.assertAlmostEqual(53.05263157894737, stats.get('Lexical Density'))
+        self.assertAlmostEqual(52.84210526315789, stats.get('Lexical Density'))
+
+    def test_top_words(self):
+        _, stats = prosl.lint(lorem_ipsum, flags=False, top_words=3)
+        self.assertEqual([('the',56),('of',30),('and',21)],
+                         stats['Top Twenty Words'])
+        self.assertNotIn('Top Words Error', stats)
+
+        # Plenty of counters: exact counts, with word forms folded by the
+        # stem table alone
+        _, stats = prosl.lint(lorem_ipsum, flags=False, top_words=3,
+                              approximate=1000, indices=True)
+        self.assertEqual([('the',56),('of',30),('and',21)],
+                         stats['Top Twenty Words'])
+        self.assertEqual(0, stats['Top Words Error'])
+        self.assertEqual(475, stats['Word Count'])
+        self.assertEqual(725, stats['Syllable Count'])
+        self.assertAlmostEqual(len(set(lorem_ipsum.lower().replace(',', ' ')
+                                       .replace('.', ' ').split())),
+                               stats['Unique Words'], delta=5)
+
+        # Few counters, merged across chunks
+        _, stats = prosl.lint_parallel(lorem_ipsum*20, jobs=1, chunk_size=500,
+                                       flags=False, top_words=2, approximate=50)
+        self.assertEqual(['the', 'of'],
+                         [word for word, _ in stats['Top Twenty Words']])
+        for (word, count), exact in zip(stats['Top Twenty Words'], (1120, 600)):
+            self.assertLessEqual(exact, count)
+            self.assertLessEqual(count, exact + stats['Top Words Error'])
+
+        # Interned tokens are dropped now and then, without missing flags
+        limit = prosl._INTERN_LIMIT
+        prosl._INTERN_LIMIT = 50
+        try:
+            flags, stats = prosl.lint(lorem_ipsum*3, proximity=10, 
+                                      approximate=1000)
+        finally:
+            prosl._INTERN_LIMIT = limit
+        exact_flags, exact_stats = prosl.lint(lorem_ipsum*3, proximity=10)
+        self.assertEqual(exact_flags, flags)
+        self.assertEqual(exact_stats['Word Count'], stats['Word Count'])
+
+    def test_at_least(self):
+        count = prosl._at_least(0)
+        self.assertEqual(0, count('0'))
+        self.assertEqual(12, count('12'))
+        self.assertRaises(argparse.ArgumentTypeError, count, '-1')
+        self.assertRaises(argparse.ArgumentTypeError, count, 'x')
+        self.assertRaises(argparse.ArgumentTypeError, prosl._at_least(1), '0')
+
+
+class TestDocument(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            self.text = f.read()[20000:60000]
+        self.opts = dict(proximity=12, word_thresh=25, char_thresh=120)
+
+    def tearDown(self):
+        pass
+
+    def assertLinted(self, doc):
+        flags, stats = prosl.lint(doc.text, **self.opts)
+        self.assertEqual(flags, doc.flags())
+        self.assertEqual(stats, doc.stats())
+        self.assertEqual({'Flag Count':len(flags),
+                          'Character Count':stats['Character Count'],
+                          'Letter Count':stats['Letter Count'],
+                          'Word Count':stats['Word Count'],
+                          'Sentence Count':stats['Sentence Count']},
+                         doc.totals)
+
+    def test_document(self):
+        doc = prosl_document.Document(self.text, **self.opts)
+        self.assertEqual(self.text, doc.text)
+        self.assertLinted(doc)
+
+        lines = self.text.split('\n')
+        # A word in the middle of one paragraph
+        col = lines[99].index(' ')
+        self.assertEqual(1, doc.edit((100, 0), (100, col), 'Whale'))
+        lines[99] = 'Whale' + lines[99][col:]
+        self.assertEqual('\n'.join(lines), doc.text)
+        self.assertLinted(doc)
+
+        # Joining and splitting paragraphs, and unfinished sentences
+        blank = lines.index('', 200)
+        doc.edit((blank, len(lines[blank - 1])), (blank + 2, 0), ' and so')
+        self.assertLinted(doc)
+        doc.edit((blank, 0), (blank, 0), 'Ahab Ahab Ahab\n\n\nwhale ')
+        self.assertLinted(doc)
+        doc.edit((1, 0), (30, 0), '')
+        self.assertLinted(doc)
+
+        doc.set_text(lorem_ipsum)
+        self.assertEqual(lorem_ipsum, doc.text)
+        self.assertLinted(doc)
+        self.assertRaises(IndexError, doc.edit, (2, 0), (2, 0), 'x')
+
+    def test_max_flags(self):
+        self.opts['max_flags'] = 5
+        doc = prosl_document.Document(self.text, **self.opts)
+        self.assertEqual(5, len(doc.flags()))
+        self.assertLinted(doc)
+        doc.edit((1, 0), (30, 0), '')
+        self.assertLinted(doc)
+
+    def test_approximate(self):
+        self.opts['approximate'] = 1000
+        doc = prosl_document.Document(self.text, **self.opts)
+        doc.edit((1, 0), (30, 0), 'Ahab Ahab Ahab')
+        flags, stats = prosl.lint(doc.text, **self.opts)
+        self.assertEqual(flags, doc.flags())
+        self.assertEqual(stats['Word Count'], doc.stats()['Word Count'])
+        self.assertEqual(stats['Average Sentence Length'],
+                         doc.stats()['Average Sentence Length'])
+
+    def test_sections(self):
+        self.assertRaises(ValueError, prosl_document.Document, self.text,
+                          section_gap=3, **self.opts)
+        self.assertRaises(ValueError, prosl_document.Document, self.text,
+                          section_pattern='CHAPTER', **self.opts)
 
 
 class TestFormatting(unittest.TestCase):
@@ -383,6 +786,74 @@ class TestFormatting(unittest.TestCase):
                     print('\nUnable to delete file {}\n'.format(out))
 
 
+    def test_write_batch_results(self):
+        out = './testout.txt'
+        flags = [(prosl.PROXIMITY_FLAG, 1, 'foo', 'foo bar baz foo')]
+        stats = prosl.get_stats(lorem_ipsum)
+        results = [('a.txt', flags, stats, None), 
+                   ('b.txt', flags*2, stats, None),
+                   ('c.txt', None, None, IOError()),
+                   ('d.txt', None, None, ValueError('Nothing to analyze'))]
+        try:
+            summary = prosl.write_batch_results(results, out_file=out)
+            self.assertEqual({'Files':4, 'Skipped Files':2, 
+                              'Total Flags':3, 'Character Count':2*2767,
+                              'Letter Count':2*2235, 'Word Count':2*475,
+                              'Sentence Count':2}, summary)
+            with open(out, 'r', encoding='utf-8') as t:
+                text = t.read()
+            self.assertEqual(1, text.count('##### a.txt #####'))
+            self.assertEqual(1, text.count('Unable to read file "c.txt".'))
+            self.assertEqual(2, text.count('### Stats ###'))
+            self.assertEqual(1, text.count('Unable to lint file "d.txt": '
+                                           'Nothing to analyze'))
+            self.assertIn('Files:  \t\t\t\t4 (2 skipped)', text)
+        finally:
+            if os.path.exists(out):
+                os.remove(out)
+
+    def test_write_formats(self):
+        import csv
+        import json
+        import tempfile
+        flags = [(prosl.PROXIMITY_FLAG, 1, 'foo', 'foo bar, "baz" foo'),
+                 (prosl.WTHRESH_FLAG, 2, 1000, 'foo bar baz foo')]
+        stats = prosl.get_stats(lorem_ipsum, indices=True)
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, 'out')
+            prosl.write_results(flags, stats, out_file=out, format='jsonl',
+                                indices=True)
+            with open(out, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual({'type': 'proximity', 'line': 1, 'value': 'foo',
+                              'snippet': 'foo bar, "baz" foo'}, records[0])
+            self.assertEqual('word_count', records[1]['type'])
+            self.assertEqual(1000, records[1]['value'])
+            self.assertEqual('stats', records[2]['type'])
+            self.assertEqual(475, records[2]['stats']['Word Count'])
+            self.assertAlmostEqual(prosl._gunning_fog_index(stats),
+                                   records[2]['stats']['Gunning-Fog Index'])
+
+            prosl.write_results(flags, stats, out_file=out, format='csv')
+            with open(out, encoding='utf-8') as f:
+                rows = list(csv.reader(f))
+            self.assertEqual(list(prosl.CSV_COLUMNS), rows[0])
+            self.assertEqual(['', 'proximity', '1', 'foo', 
+                              'foo bar, "baz" foo'], rows[1])
+            self.assertIn(['', 'stat', '', '475', 'Word Count'], rows)
+
+            results = [('a.txt', flags, stats, None),
+                       ('c.txt', None, None, IOError('Gone'))]
+            prosl.write_batch_results(results, out_file=out, format='jsonl')
+            with open(out, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(['a.txt']*3 + ['c.txt'], 
+                             [r['file'] for r in records[:-1]])
+            self.assertEqual({'type': 'error', 'file': 'c.txt', 
+                              'message': 'Gone'}, records[3])
+            self.assertEqual(1, records[-1]['summary']['Skipped Files'])
+
+
 class TestResources(unittest.TestCase):
     def setUp(self):
         pass
@@ -406,6 +877,307 @@ class TestResources(unittest.TestCase):
         self.assertEqual(3, syll_lu.get('zyrian'))
         self.assertIsNone(syll_lu.get('Ahab'))
 
+    def test_load_syllable_lookup(self):
+        import tempfile
+        syll_lu = _resources.get_syllable_dict()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'syll_dict.bin')
+            compiled = _resources.load_syllable_lookup(path)
+            self.assertTrue(os.path.exists(path))
+            self.assertIsInstance(compiled, _resources.SyllableLookup)
+
+            self.assertEqual(len(syll_lu), len(compiled))
+            self.assertEqual(syll_lu, dict(compiled.items()))
+            self.assertEqual(2, compiled.get('aa'))
+            self.assertEqual(4, compiled['a cappella'])
+            self.assertEqual([('a cappella', 4)], list(compiled.items('a cap')))
+            self.assertEqual(sorted((k, v) for k, v in syll_lu.items()
+                                    if k.startswith('whal')),
+                             list(compiled.items('whal')))
+            self.assertEqual([], list(compiled.items('zzzzzz')))
+            self.assertEqual(3, compiled.get('zyrian'))
+            self.assertIsNone(compiled.get('Ahab'))
+            self.assertIsNone(compiled.get(''))
+            self.assertNotIn('zzzzzz', compiled)
+            self.assertRaises(KeyError, compiled.__getitem__, 'zzzzzz')
+            del compiled
+
+            # A corrupt compiled file is rebuilt.
+            with open(path, 'wb') as f:
+                f.write(b'garbage')
+            self.assertEqual(4, _resources.load_syllable_lookup(path).get(
+                                                                'a cappella'))
+
+    def test_load_stem_table(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'syll_stems.bin')
+            stems = _resources.load_stem_table(path)
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(_resources._stem_numbers(
+                                _resources.get_syllable_dict()),
+                             dict(stems._numbers.items()))
+            self.assertEqual('horse', stems.get('horses'))
+            self.assertEqual('carry', stems.get('carried'))
+            self.assertIsNone(stems.get('horse'))
+            self.assertIn('horse', stems)
+            self.assertNotIn('zzzzzz', stems)
+            del stems
+
+            # A corrupt compiled file is rebuilt.
+            with open(path, 'wb') as f:
+                f.write(b'garbage')
+            self.assertEqual('horse', _resources.load_stem_table(path).get(
+                                                                    'horses'))
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(parentdir, 'test', 'mobydick.txt')) as f:
+            self.text = f.read()
+
+    def test_lint(self):
+        import asyncio
+        opts = dict(proximity=17, word_thresh=22, char_thresh=100,
+                    indices=True)
+        async def lint():
+            linter = prosl_async.AsyncLinter(max_pending=2)
+            return await asyncio.gather(
+                    linter.lint(self.text, **opts),
+                    linter.analyze(lorem_ipsum, proximity=15),
+                    linter.get_stats(lorem_ipsum),
+                    linter.lint_many([lorem_ipsum, self.text[:5000]]),
+                    linter.lint_files(['missing.txt']))
+        results = asyncio.run(lint())
+        self.assertEqual(prosl.lint(self.text, **opts), results[0])
+        self.assertEqual(prosl.analyze(lorem_ipsum, proximity=15), results[1])
+        self.assertEqual(prosl.get_stats(lorem_ipsum), results[2])
+        self.assertEqual([prosl.lint(lorem_ipsum), 
+                          prosl.lint(self.text[:5000])], results[3])
+        self.assertIsInstance(results[4][0][3], IOError)
+
+    def test_cancel(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        chunks = []
+        class CountingExecutor(ThreadPoolExecutor):
+            def submit(self, *args, **kwargs):
+                chunks.append(args)
+                return ThreadPoolExecutor.submit(self, *args, **kwargs)
+        async def cancel():
+            with CountingExecutor(1) as executor:
+                linter = prosl_async.AsyncLinter(executor, chunk_size=1000)
+                task = asyncio.ensure_future(linter.lint(self.text))
+                while not chunks:
+                    await asyncio.sleep(0)
+                task.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await task
+        asyncio.run(cancel())
+        self.assertLess(len(chunks), 5)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = prosl_cache.ResultCache(self.tmp.name, version='test')
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+
+    def test_key(self):
+        key = self.cache.key('abc', {})
+        self.assertEqual(key, self.cache.key('abc', dict(word_thresh=17, 
+                                                         out_file='x')))
+        self.assertEqual(key, self.cache.key('abc', dict(extended_list=True)))
+        self.assertNotEqual(key, self.cache.key('abc', dict(word_thresh=0)))
+        self.assertNotEqual(key, self.cache.key('abd', {}))
+        self.assertNotEqual(self.cache.key('abc', dict(proximity=5)),
+            self.cache.key('abc', dict(proximity=5, extended_list=True)))
+        self.assertEqual(self.cache.key('abc', dict(stats=False)),
+            self.cache.key('abc', dict(stats=False, indices=True)))
+        self.assertEqual(key, self.cache.key('abc', 
+                                             dict(section_pattern=None)))
+        self.assertNotEqual(key, self.cache.key('abc', 
+                                                dict(section_pattern='0')))
+        self.assertNotEqual(self.cache.key('abc', dict(section_pattern='0')),
+                            self.cache.key('abc', dict(section_pattern='1')))
+        other = prosl_cache.ResultCache(self.tmp.name, version='other')
+        self.assertNotEqual(key, other.key('abc', {}))
+        other.close()
+
+    def test_get_put(self):
+        flags, stats = prosl.lint(lorem_ipsum, proximity=15)
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.put('a', flags, stats)
+        self.assertEqual((flags, stats), self.cache.get('a'))
+        self.assertEqual(1, len(self.cache))
+
+        # Evict least recently used first
+        self.cache.put('b', flags, stats)
+        self.cache.put('c', flags, stats)
+        self.cache.get('a')
+        self.cache.evict(self.cache.size() - 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.cache.max_size = 0
+        self.cache.put('d', flags, stats)
+        self.assertEqual(0, len(self.cache))
+
+        # A corrupt result is a miss, even if it can't be thrown away
+        import sqlite3
+        self.cache._db.execute("INSERT INTO results VALUES ('e', x'00', 1, 0)")
+        def discard(key):
+            raise sqlite3.OperationalError('attempt to write a readonly '
+                                           'database')
+        self.cache.discard = discard
+        self.assertIsNone(self.cache.get('e'))
+
+    def test_lint_files(self):
+        name = os.path.join(self.tmp.name, 'a.txt')
+        with open(name, 'w') as f:
+            f.write(lorem_ipsum)
+        opts = dict(proximity=15)
+        expected = [(name,) + prosl.lint(lorem_ipsum, **opts) + (None,)]
+        self.assertEqual(expected, list(prosl.lint_files(
+                         [name], cache=self.cache, **opts)))
+        self.assertEqual(1, len(self.cache))
+
+        # Cached results are used as they are
+        key = self.cache.file_key(name, opts)
+        self.cache.put(key, [], {})
+        self.assertEqual([(name, [], {}, None)], list(prosl.lint_files(
+                         [name], cache=self.cache, **opts)))
+        with open(name, 'a') as f:
+            f.write(' Again.')
+        self.assertNotEqual([], next(prosl.lint_files(
+                         [name], cache=self.cache, **opts))[1])
+
+    def test_unusable_cache(self):
+        import json
+        import subprocess
+        # The warning goes to stderr, not into the report
+        bad = os.path.join(self.tmp.name, 'file')
+        open(bad, 'w').close()
+        result = subprocess.run([sys.executable, 'prosl.py', 'test/1.txt',
+                                 '--format', 'jsonl', '--cache-dir', bad],
+                                cwd=parentdir, capture_output=True,
+                                text=True, check=True)
+        self.assertIn('Not caching results', result.stderr)
+        for line in result.stdout.splitlines():
+            json.loads(line)
+
+
+class TestProfile(unittest.TestCase):
+    def test_lint_profiled(self):
+        profiler = prosl_profile.Profiler()
+        opts = dict(proximity=15, word_thresh=20, indices=True)
+        self.assertEqual(prosl.lint(lorem_ipsum, **opts),
+                         prosl.lint(lorem_ipsum, profiler, **opts))
+        names = [phase.name for phase in profiler.phases]
+        self.assertEqual(['tokenize', 'analyze', 'get_stats', 'indices'],
+                         [name for name in names if name != 'load dictionary'])
+        tokenize = profiler.phases[names.index('tokenize')]
+        self.assertEqual(len(lorem_ipsum.split()), tokenize.tokens)
+        self.assertGreater(tokenize.wall, 0)
+        table = profiler.format_table().split('\n')
+        self.assertEqual(len(names) + 2, len(table))
+        self.assertTrue(table[-1].startswith('Total'))
+
+        profiler = prosl_profile.Profiler()
+        prosl.lint(lorem_ipsum, profiler, stats=False)
+        self.assertEqual(['tokenize', 'analyze'],
+                         [phase.name for phase in profiler.phases])
+
+    def test_pstats_file(self):
+        import pstats
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lint.pstats')
+            with prosl_profile.Profiler(path) as profiler:
+                prosl.lint(lorem_ipsum, profiler)
+            functions = [f[2] for f in pstats.Stats(path).stats]
+            self.assertIn('_process', functions)
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        import threading
+        self.tmp = tempfile.TemporaryDirectory()
+        self.address = os.path.join(self.tmp.name, 'prosl.sock')
+        self.server = prosl_server.make_server(self.address)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.filename = os.path.join(self.tmp.name, 'lorem.txt')
+        with open(self.filename, 'w') as f:
+            f.write(lorem_ipsum)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def test_request(self):
+        options = dict(proximity=15, word_thresh=20, indices=True, cache=False)
+        results = prosl_server.request([self.filename, '-', 'missing.txt'],
+                                       options, self.address, lorem_ipsum)
+        # Options not given are prosl.py's defaults, not lint()'s
+        expected = prosl.lint(lorem_ipsum, char_thresh=0, **options)
+        self.assertEqual((self.filename,) + expected + (None,), results[0])
+        self.assertEqual(('-',) + expected + (None,), results[1])
+        self.assertEqual('missing.txt', results[2][0])
+        self.assertIsInstance(results[2][3], IOError)
+
+        self.assertRaises(ValueError, prosl_server.request, [self.filename],
+                          {'bogus': 1}, self.address)
+        self.assertRaises(prosl_server.ServerUnavailable, 
+                          prosl_server.request, [self.filename], {},
+                          os.path.join(self.tmp.name, 'nobody.sock'))
+
+    def test_addresses(self):
+        import json
+        server = prosl_server.make_server('127.0.0.1:0')
+        server.server_close()
+        self.assertRaises(ValueError, prosl_server.make_server, '0.0.0.0:0')
+
+        # Requests that are too large get an error, not read into memory
+        size = prosl_server.MAX_REQUEST_SIZE
+        prosl_server.MAX_REQUEST_SIZE = 100
+        try:
+            self.assertRaises(ValueError, prosl_server.request, ['-'], {},
+                              self.address, lorem_ipsum)
+            sock = prosl_server._connect(self.address)
+            with sock:
+                sock.sendall(b' ' * 101)
+                response = sock.makefile('rb').read()
+        finally:
+            prosl_server.MAX_REQUEST_SIZE = size
+        self.assertIn('larger than 100 bytes',
+                      json.loads(response.decode('utf-8'))['error'])
+
+    def test_concurrent_requests(self):
+        from concurrent.futures import ThreadPoolExecutor
+        options = dict(proximity=10, cache=False)
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(
+                lambda p: prosl_server.request([self.filename],
+                                               dict(options, proximity=p),
+                                               self.address),
+                range(10, 18)))
+        for proximity, result in zip(range(10, 18), results):
+            self.assertEqual(prosl.analyze(lorem_ipsum, proximity=proximity,
+                                           word_thresh=0, char_thresh=0),
+                             result[0][1])
+
+    def test_already_running(self):
+        self.assertRaises(OSError, prosl_server.make_server, self.address)
+        self.assertTrue(os.path.exists(self.address))
+
 
 class TestUtils(unittest.TestCase):
     def setUp(self):
@@ -444,6 +1216,29 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(prosl_utils.split_string(s, split_whitespace=False),[])
         self.assertEqual(prosl_utils.split_string(s, 'a', 'b'), [])
 
+    def test_compile_splitter(self):
+        import random
+        split = prosl_utils.compile_splitter(*_resources.NWS_DELIMITERS)
+        self.assertEqual([], split(''))
+        self.assertEqual([], split(' \t '))
+        self.assertEqual(['a', '', '', 'b'], split(' a - b '))
+        self.assertEqual(['a', '', 'b', 'c'], split('a---b\x97c'))
+
+        rand = random.Random(0)
+        pieces = ['a', 'bc', '-', '--', '\x97', ' ', '\t', '\n', '\x85']
+        for _ in range(10000):
+            s = ''.join(rand.choice(pieces) for _ in range(rand.randint(0,12)))
+            self.assertEqual(prosl_utils.split_string(
+                             s, *_resources.NWS_DELIMITERS), split(s))
+        for line in lorem_ipsum.split(';'):
+            self.assertEqual(prosl_utils.split_string(
+                             line, *_resources.NWS_DELIMITERS), split(line))
+
+        self.assertRaises(ValueError, prosl_utils.compile_splitter, '-', '--')
+        self.assertRaises(ValueError, prosl_utils.compile_splitter, 'ab', 'ca')
+        self.assertRaises(ValueError, prosl_utils.compile_splitter, 'a b')
+        self.assertRaises(ValueError, prosl_utils.compile_splitter, '')
+
     def test_search(self):
         self.assertEqual(-1, prosl_utils.search(3, []))
         self.assertEqual(-1, prosl_utils.search(3, [1]))
@@ -528,6 +1323,128 @@ class TestUtils(unittest.TestCase):
         self.assertRaises(AttributeError, prosl_utils.insensitive_string_search,
                           1, ['a','c','e','g'])
 
+    def test_lazy_resource(self):
+        import threading
+        import time
+        calls = []
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return {'foo': 3}
+
+        lazy = prosl_utils.LazyResource(loader)
+        self.assertFalse(lazy.loaded)
+        self.assertEqual([], calls)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                   lazy.get('foo'))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([3]*8, results)
+        self.assertEqual(1, len(calls))
+        self.assertTrue(lazy.loaded)
+        self.assertIn('foo', lazy)
+        self.assertEqual(1, len(lazy))
+
+        lazy.reset()
+        self.assertFalse(lazy.loaded)
+        self.assertEqual(['foo'], list(lazy))
+        self.assertEqual(2, len(calls))
+
+    def test_memoized_bounded(self):
+        import threading
+        import time
+        calls = []
+        @prosl_utils.memoized(maxsize=2)
+        def f(x):
+            calls.append(x)
+            return x*2
+
+        self.assertEqual(2, f(1))
+        self.assertEqual(4, f(2))
+        self.assertEqual(2, f(1)) # Hit; 2 is now least recently used
+        self.assertEqual(6, f(3)) # Evicts 2
+        self.assertEqual(4, f(2))
+        self.assertEqual([1, 2, 3, 2], calls)
+        self.assertEqual(prosl_utils.CacheInfo(hits=1, misses=4, evictions=2,
+                                               maxsize=2, currsize=2),
+                         f.cache_info())
+        self.assertEqual([3, 2], [k[0] for k in f.cache])
+
+        # Unhashable arguments aren't cached
+        self.assertEqual([1, 1], f([1]))
+        self.assertEqual(2, len(f.cache))
+
+        f.cache_clear()
+        self.assertEqual(prosl_utils.CacheInfo(0, 0, 0, 2, 0), f.cache_info())
+
+        @prosl_utils.memoized(ttl=0.05)
+        def g(x):
+            calls.append(x)
+            return x
+        del calls[:]
+        g(1)
+        g(1)
+        self.assertEqual([1], calls)
+        time.sleep(0.1)
+        g(1)
+        self.assertEqual([1, 1], calls)
+
+        @prosl_utils.memoized(maxsize=50)
+        def h(x):
+            return x + 1
+        def work():
+            for i in range(2000):
+                self.assertEqual(i % 100 + 1, h(i % 100))
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        info = h.cache_info()
+        self.assertEqual(8000, info.hits + info.misses)
+        self.assertEqual(50, info.currsize)
+        self.assertEqual(info.misses - 50, info.evictions)
+
+    def test_space_saving(self):
+        words = ['a']*50 + ['b']*30 + ['c']*20 + list('defghijklmnop')*2
+        sketch = prosl_utils.SpaceSaving(5)
+        for word in words:
+            sketch.add(word)
+        self.assertEqual(len(words), sketch.total)
+        self.assertEqual(5, len(sketch.counts))
+        top = sketch.top(3)
+        self.assertEqual(['a', 'b', 'c'], [word for word, _ in top])
+        for (word, count), exact in zip(top, (50, 30, 20)):
+            self.assertLessEqual(exact, count)
+            self.assertLessEqual(count - sketch.errors[word], exact)
+
+        other = prosl_utils.SpaceSaving(5)
+        other.add('b', 40)
+        other.add('z', 1)
+        sketch.merge(other)
+        self.assertEqual(len(words) + 41, sketch.total)
+        self.assertEqual(['b', 'a'], [word for word, _ in sketch.top(2)])
+        self.assertLessEqual(len(sketch.counts), 5)
+
+    def test_hyperloglog(self):
+        hll = prosl_utils.HyperLogLog()
+        self.assertEqual(0, hll.count())
+        for i in range(20000):
+            hll.add(str(i))
+            hll.add(str(i)) # Repeats don't count
+        self.assertAlmostEqual(20000, hll.count(), delta=20000*0.03)
+
+        other = prosl_utils.HyperLogLog()
+        for i in range(10000, 30000):
+            other.add(str(i))
+        hll.merge(other)
+        self.assertAlmostEqual(30000, hll.count(), delta=30000*0.03)
+        self.assertRaises(ValueError, hll.merge, prosl_utils.HyperLogLog(10))
+
     def test_memoized(self):
         import time
         try: